@@ -2,6 +2,7 @@
 
 from typing import Any, Dict, List, Optional
 
+import contextlib
 import dataclasses
 import argparse
 import re
@@ -12,6 +13,36 @@ import drawsvg as draw  # pip install drawsvg
 from hyperbolic import euclid3d  # pip install hyperbolic
 import hyperbolic.euclid as shapes
 
+from bloch_sphere import gif, shards
+from bloch_sphere.clip_library import CLIFFORD_ROTATIONS, ClipLibraryAnimation
+from bloch_sphere.frame_store import (
+    FrameStore, StoredFrameAnimation, rasterize_frame)
+from bloch_sphere.raw_output import RawFrameAnimation
+from bloch_sphere.segment_cache import SegmentCacheAnimation
+
+
+XY_COLORS = ['#56e', '#239', '#56e', '#56e']
+YZ_COLORS = ['#e1e144', '#909022', '#e1e144', '#e1e144']
+ZX_COLORS = ['#9e2', '#6a1', '#9e2', '#9e2']
+# Every color drawn by draw_bloch_sphere (white, black, red, orange, bands)
+SCENE_COLORS = ('#fff', '#000', '#c00', '#e00', '#ffa500',
+                *XY_COLORS, *YZ_COLORS, *ZX_COLORS)
+
+# Level of detail: Below LOD_PX_PER_UNIT output pixels per drawing unit, arcs
+# are drawn as polylines within LOD_ARC_ERROR_PX and elements smaller than
+# these pixel sizes are skipped.
+LOD_PX_PER_UNIT = 80
+LOD_ARC_ERROR_PX = 0.25
+LOD_MIN_TEXT_PX = 6
+LOD_MIN_ROT_PX = 6
+
+# Bump whenever the drawn frames change so stored segments and clips are
+# rendered again
+RENDER_VERSION = 2
+
+# Depth scale of the outer bands and anything sorted between them
+OUTER_Z_MUL = 10
+
 
 @dataclasses.dataclass
 class AnimState:
@@ -43,16 +74,36 @@ class AnimState:
                              id_prefix='{}-d'.format(len(self.anim.frames)),
                              **self.draw_args)
 
+    @contextlib.contextmanager
+    def _segment(self, *params):
+        '''Marks a run of frames that only depends on the current state and
+        `params` so animations that support it can reuse cached frames.'''
+        begin_segment = getattr(self.anim, 'begin_segment', None)
+        if begin_segment is None:
+            yield
+            return
+        begin_segment(self.fps, self.speed, self.inner_proj,
+                      self.inner_opacity, self.extra_opacity, self.label,
+                      self.axis, self.draw_args, *params)
+        try:
+            yield
+        except BaseException:
+            self.anim.abort_segment()
+            raise
+        self.anim.end_segment()
+
     def sphere_fade_in(self):
-        for t in self._smooth(0.4):
-            self.inner_opacity = t
-            self._draw_frame()
+        with self._segment('sphere_fade_in'):
+            for t in self._smooth(0.4):
+                self.inner_opacity = t
+                self._draw_frame()
         self.inner_opacity = 1
 
     def sphere_fade_out(self):
-        for t in self._smooth(0.4):
-            self.inner_opacity = 1-t
-            self._draw_frame()
+        with self._segment('sphere_fade_out'):
+            for t in self._smooth(0.4):
+                self.inner_opacity = 1-t
+                self._draw_frame()
         self.inner_opacity = 0
 
     def fade_in(self, label, axis):
@@ -79,49 +130,103 @@ class AnimState:
         self.inner_proj = euclid3d.rotation3d(self.axis, rads) @ start
 
     def wait(self, duration=1):
-        for i in self._wait(duration):
-            self._draw_frame()
+        with self._segment('wait', duration):
+            for i in self._wait(duration):
+                self._draw_frame()
 
     def i_gate(self):
         self.wait(2.8)
 
-    def do_gate(self, label, axis, radians):
-        self.fade_in(label, axis)
-        self.rotate(radians)
-        self.fade_out()
+    def do_gate(self, label, axis, radians, name=None):
+        '''Animates a rotation.  `name` identifies the fixed gates (e.g. 'h')
+        that a clip library stores.'''
+        with self._segment('gate', label, axis, radians, name):
+            self.fade_in(label, axis)
+            self.rotate(radians)
+            self.fade_out()
 
     def h_gate(self):
-        self.do_gate('H Gate:', (1, 0, 1), np.pi)
+        self.do_gate('H Gate:', (1, 0, 1), np.pi, name='h')
     def x_gate(self):
-        self.do_gate('X Gate:', (1, 0, 0), np.pi)
+        self.do_gate('X Gate:', (1, 0, 0), np.pi, name='x')
     def y_gate(self):
-        self.do_gate('Y Gate:', (0, 1, 0), np.pi)
+        self.do_gate('Y Gate:', (0, 1, 0), np.pi, name='y')
     def z_gate(self):
-        self.do_gate('Z Gate:', (0, 0, 1), np.pi)
+        self.do_gate('Z Gate:', (0, 0, 1), np.pi, name='z')
     def sqrt_x_gate(self):
-        self.do_gate('√X Gate:', (1, 0, 0), np.pi/2)
+        self.do_gate('√X Gate:', (1, 0, 0), np.pi/2, name='sqrt_x')
     def sqrt_y_gate(self):
-        self.do_gate('√Y Gate:', (0, 1, 0), np.pi/2)
+        self.do_gate('√Y Gate:', (0, 1, 0), np.pi/2, name='sqrt_y')
     def s_gate(self):
-        self.do_gate('S Gate:', (0, 0, 1), np.pi/2)
+        self.do_gate('S Gate:', (0, 0, 1), np.pi/2, name='s')
     def t_gate(self):
-        self.do_gate('T Gate:', (0, 0, 1), np.pi/4)
+        self.do_gate('T Gate:', (0, 0, 1), np.pi/4, name='t')
     def inv_h_gate(self):
-        self.do_gate('H⁻¹ Gate:', (1, 0, 1), -np.pi)
+        self.do_gate('H⁻¹ Gate:', (1, 0, 1), -np.pi, name='inv_h')
     def inv_x_gate(self):
-        self.do_gate('X⁻¹ Gate:', (1, 0, 0), -np.pi)
+        self.do_gate('X⁻¹ Gate:', (1, 0, 0), -np.pi, name='inv_x')
     def inv_y_gate(self):
-        self.do_gate('Y⁻¹ Gate:', (0, 1, 0), -np.pi)
+        self.do_gate('Y⁻¹ Gate:', (0, 1, 0), -np.pi, name='inv_y')
     def inv_z_gate(self):
-        self.do_gate('Z⁻¹ Gate:', (0, 0, 1), -np.pi)
+        self.do_gate('Z⁻¹ Gate:', (0, 0, 1), -np.pi, name='inv_z')
     def inv_sqrt_x_gate(self):
-        self.do_gate('√X⁻¹ Gate:', (1, 0, 0), -np.pi/2)
+        self.do_gate('√X⁻¹ Gate:', (1, 0, 0), -np.pi/2, name='inv_sqrt_x')
     def inv_sqrt_y_gate(self):
-        self.do_gate('√Y⁻¹ Gate:', (0, 1, 0), -np.pi/2)
+        self.do_gate('√Y⁻¹ Gate:', (0, 1, 0), -np.pi/2, name='inv_sqrt_y')
     def inv_s_gate(self):
-        self.do_gate('S⁻¹ Gate:', (0, 0, 1), -np.pi/2)
+        self.do_gate('S⁻¹ Gate:', (0, 0, 1), -np.pi/2, name='inv_s')
     def inv_t_gate(self):
-        self.do_gate('T⁻¹ Gate:', (0, 0, 1), -np.pi/4)
+        self.do_gate('T⁻¹ Gate:', (0, 0, 1), -np.pi/4, name='inv_t')
+
+    def channel(self, label, matrices, offsets):
+        '''Animates a non-unitary channel given the affine Bloch-vector map
+        `v -> matrices[i] @ v + offsets[i]` to apply for each frame i.'''
+        start = self.inner_proj
+        start_offset = (np.zeros(3) if start.offset is None
+                        else start.offset)
+        matrices = np.asarray(matrices, dtype=float)
+        offsets = np.asarray(offsets, dtype=float)
+        # Compose with the current orientation for all frames at once
+        frame_matrices = matrices @ start.matrix
+        frame_offsets = (np.einsum('fij,j->fi', matrices, start_offset)
+                         + offsets)
+        with self._segment('channel', label, matrices, offsets):
+            self.fade_in(label, None)
+            for mat, off in zip(frame_matrices, frame_offsets):
+                self.inner_proj = euclid3d.LinearProjection(mat, off)
+                self._draw_frame()
+            self.fade_out()
+        if len(frame_matrices):
+            self.inner_proj = euclid3d.LinearProjection(frame_matrices[-1],
+                                                        frame_offsets[-1])
+
+    def relax_channel(self, t1=np.inf, t2=None, time=1, label=None):
+        '''T1/T2 relaxation toward |0⟩ for `time` (in the units of t1, t2).'''
+        t1, time = float(t1), float(time)
+        t2 = None if t2 is None else float(t2)
+        if label is None:
+            label = 'Relaxation:'
+        self.channel(label, *relaxation_maps(time*self._smooth(2), t1, t2))
+    def amp_damp_channel(self, gamma, label=None):
+        gamma = float(gamma)
+        if label is None:
+            label = f'Damping γ={gamma:.3g}:'
+        self.channel(label, *amplitude_damping_maps(gamma*self._smooth(2)))
+    def dephase_channel(self, p, label=None):
+        p = float(p)
+        if label is None:
+            label = f'Dephasing p={p:.3g}:'
+        self.channel(label, *dephasing_maps(p*self._smooth(2)))
+    def depolarize_channel(self, p, label=None):
+        p = float(p)
+        if label is None:
+            label = f'Depolarizing p={p:.3g}:'
+        self.channel(label, *depolarizing_maps(p*self._smooth(2)))
+    def kraus_channel(self, kraus, label='Channel:'):
+        '''Animates the channel with the given 2x2 Kraus operators by mixing
+        it in with increasing probability.'''
+        self.channel(label, *kraus_maps(kraus, self._smooth(2)))
+
     def custom_gate(self, x, y, z, r_pi=1, label=None):
         x = float(x)
         y = float(y)
@@ -131,7 +236,19 @@ class AnimState:
             label = f'{r_pi:.3f}π about ({x:.3f}, {y:.3f}, {z:.3f})'
         self.do_gate(label, (x, y, z), np.pi*r_pi)
 
+    def apply_rotations(self, rotations, final_wait=True):
+        '''Animates each gate of a `Rotations`.'''
+        for axis, radians, label in zip(rotations.axes.tolist(),
+                                        rotations.angles.tolist(),
+                                        rotations.gate_labels()):
+            self.do_gate(label, tuple(axis), radians)
+        if final_wait:
+            self.wait()
+
     def apply_gate_list(self, gates, final_wait=True):
+        if isinstance(gates, Rotations):
+            self.apply_rotations(gates, final_wait=final_wait)
+            return
         non_gates = {'wait', 'no_wait'}
         block_gates = {'do'}
         no_wait = False
@@ -163,6 +280,18 @@ class AnimState:
                 self.custom_gate(x, y, z, r_pi, label=label)
                 continue
 
+            channel_name, *channel_args = re.split('[,;]', gate)
+            channel = getattr(self, channel_name.replace('-', '_')+'_channel',
+                              None)
+            if channel is not None and channel_name != 'kraus':
+                try:
+                    channel(*channel_args)
+                except (ValueError, TypeError):
+                    print(f'Error: Invalid channel arguments {gate}.')
+                    sys.exit(1)
+                    return
+                continue
+
             gate = gate.replace('-', '_')
             if gate in block_gates:
                 print(f'Error: Invalid gate name "{gate}".')
@@ -183,37 +312,329 @@ class AnimState:
         if not no_wait and final_wait:
             self.wait()
 
+def relaxation_maps(t, t1=np.inf, t2=None):
+    '''Affine Bloch-vector maps (matrices, offsets) of T1/T2 relaxation for
+    each evolution time in the array `t`.  `t2` defaults to `2*t1`.'''
+    t = np.asarray(t, dtype=float)
+    if t2 is None:
+        t2 = 2*t1
+    if not (t1 > 0 and t2 > 0) or np.any(t < 0):
+        raise ValueError('T1 and T2 must be positive and the time at least 0.')
+    if t2 > 2*t1:
+        raise ValueError('T2 must be at most 2*T1.')
+    e1 = np.exp(-t/t1)
+    e2 = np.exp(-t/t2)
+    return _diagonal_maps(e2, e2, e1, 1-e1)
+
+def amplitude_damping_maps(gamma):
+    '''Affine Bloch-vector maps of amplitude damping for each damping
+    probability in the array `gamma`.'''
+    gamma = _probabilities(gamma, 'Damping probability')
+    return _diagonal_maps(np.sqrt(1-gamma), np.sqrt(1-gamma), 1-gamma, gamma)
+
+def dephasing_maps(p):
+    '''Affine Bloch-vector maps of dephasing (a Z error with probability
+    `p`) for each value in the array `p`.'''
+    p = _probabilities(p, 'Dephasing probability')
+    return _diagonal_maps(1-2*p, 1-2*p, np.ones_like(p), np.zeros_like(p))
+
+def depolarizing_maps(p):
+    '''Affine Bloch-vector maps of the depolarizing channel
+    `rho -> (1-p) rho + p I/2` for each value in the array `p`.'''
+    p = _probabilities(p, 'Depolarizing probability')
+    return _diagonal_maps(1-p, 1-p, 1-p, np.zeros_like(p))
+
+def _probabilities(p, name):
+    p = np.asarray(p, dtype=float)
+    if not np.all((p >= 0) & (p <= 1)):
+        raise ValueError(f'{name} must be between 0 and 1.')
+    return p
+
+def _diagonal_maps(sx, sy, sz, z_offset):
+    matrices = np.zeros(np.shape(sx) + (3, 3))
+    matrices[..., 0, 0] = sx
+    matrices[..., 1, 1] = sy
+    matrices[..., 2, 2] = sz
+    offsets = np.zeros(np.shape(sx) + (3,))
+    offsets[..., 2] = z_offset
+    return matrices, offsets
+
+_PAULIS = np.array([[[0, 1], [1, 0]], [[0, -1j], [1j, 0]], [[1, 0], [0, -1]]])
+
+def kraus_maps(kraus, s):
+    '''Affine Bloch-vector maps of the channel
+    `rho -> (1-s) rho + s sum_k K_k rho K_k^dagger` for each mixing
+    probability in the array `s`.'''
+    kraus = np.asarray(kraus, dtype=complex).reshape(-1, 2, 2)
+    s = np.asarray(s, dtype=float)
+    # M_ij = Tr(P_i E(P_j))/2,  c_i = Tr(P_i E(I))/2
+    out = np.einsum('kab,jbc,kdc->jad', kraus, _PAULIS, kraus.conj())
+    matrix = np.einsum('iab,jba->ij', _PAULIS, out).real / 2
+    out = np.einsum('kab,kcb->ac', kraus, kraus.conj())
+    offset = np.einsum('iab,ba->i', _PAULIS, out).real / 2
+    s = s[..., None]
+    matrices = (1-s[..., None])*np.eye(3) + s[..., None]*matrix
+    offsets = s*offset
+    return matrices, offsets
+
+def unitaries_to_axis_angles(unitaries):
+    '''Bloch sphere rotation axes (N x 3) and angles (N, radians in [0, π])
+    of a stack of 2x2 unitaries, ignoring global phase.'''
+    u = np.asarray(unitaries, dtype=complex).reshape(-1, 2, 2)
+    # Remove the global phase:  V = cos(θ/2) I - i sin(θ/2) n·σ
+    v = u / np.sqrt(np.linalg.det(u))[:, None, None]
+    cos = np.einsum('naa->n', v).real / 2
+    sin_axes = -np.einsum('iab,nba->ni', _PAULIS, v).imag / 2
+    # Choose the sign of V that gives the shorter rotation
+    sign = np.where(cos < 0, -1, 1)
+    cos = cos * sign
+    sin_axes = sin_axes * sign[:, None]
+    sin = np.linalg.norm(sin_axes, axis=-1)
+    angles = 2*np.arctan2(sin, cos)
+    axes = np.zeros_like(sin_axes)
+    axes[:, 2] = 1  # Arbitrary axis for the identity
+    nonzero = sin > 1e-12
+    axes[nonzero] = sin_axes[nonzero] / sin[nonzero, None]
+    return axes, angles
+
+
+@dataclasses.dataclass
+class Rotations:
+    '''Single-qubit gates given numerically as Bloch sphere rotation `axes`
+    (N x 3) and `angles` (N, radians) with optional display `labels`.
+
+    Pass to `AnimState.apply_gate_list` instead of a list of gate names.
+    '''
+    axes: np.ndarray
+    angles: np.ndarray
+    labels: Optional[List[str]] = None
+
+    def __post_init__(self):
+        axes = np.asarray(self.axes, dtype=float).reshape(-1, 3)
+        angles = np.broadcast_to(
+            np.asarray(self.angles, dtype=float), len(axes)).copy()
+        norms = np.linalg.norm(axes, axis=-1)
+        zero = norms == 0
+        if np.any(zero & (angles != 0)):
+            raise ValueError('Rotation axes must be nonzero.')
+        axes[zero] = (0, 0, 1)
+        norms[zero] = 1
+        self.axes = axes / norms[:, None]
+        self.angles = angles
+        if self.labels is not None and len(self.labels) != len(angles):
+            raise ValueError(f'Got {len(self.labels)} labels for '
+                             f'{len(angles)} rotations.')
+
+    @classmethod
+    def from_unitaries(cls, unitaries, labels=None):
+        '''Converts a stack of 2x2 unitaries (N x 2 x 2) in one pass.'''
+        axes, angles = unitaries_to_axis_angles(unitaries)
+        return cls(axes, angles, labels)
+
+    def __len__(self):
+        return len(self.angles)
+
+    def as_json(self):
+        return dict(axes=self.axes.tolist(), angles=self.angles.tolist(),
+                    labels=self.labels)
+
+    def gate_labels(self):
+        if self.labels is not None:
+            return list(self.labels)
+        return [f'{r_pi:.3f}π about ({x:.3f}, {y:.3f}, {z:.3f})'
+                for (x, y, z), r_pi in zip(self.axes.tolist(),
+                                           (self.angles/np.pi).tolist())]
+
 def do_or_save_animation(name: str, save=False, fps=20, preview=True,
-                         style='sphere'):
+                         style='sphere', resume=False, cache_dir=None,
+                         optimize_gif=False, alpha=False, shard=None,
+                         frame_range=None, merge=False, clip_library=None,
+                         draw_args=None):
+    '''Decorator that renders the animation described by `func(state)`.
+
+    `draw_args` are extra arguments to `draw_frame` (e.g. the output size
+    `w`) for every frame.
+
+    If `resume` is set and `save` is 'gif' or 'mp4', rasterized frames are
+    checkpointed to a frame store next to the output file
+    (`{name}.{ext}.frames`) and a rerun after an interruption skips the
+    frames that were already rendered.  `resume` may be any JSON-able value
+    identifying the animation (e.g. the gate list) so a store left by a
+    different animation with the same name is not reused.
+
+    If `cache_dir` is set and `save` is 'gif' or 'mp4', the frames of each
+    gate, wait and fade are cached in `cache_dir` keyed by the state before
+    it.  Rerunning an edited gate sequence only renders the segments that
+    changed and splices in the rest from the cache.  (`resume` is not needed
+    with `cache_dir` since completed segments are kept.)
+
+    If `clip_library` is set instead, named fixed gates, waits, and fades
+    starting from one of the 24 Clifford orientations are stored in that
+    directory as encoded clips (see `build_clip_library`).  The output is
+    assembled by concatenating the clips and the frames drawn for everything
+    else without re-encoding the clips.
+
+    If `optimize_gif` is set and `save` is 'gif', the GIF is encoded by
+    `save_frames` with a fixed scene palette and inter-frame deltas.
+
+    If `save` is 'raw', the raw RGB (or RGBA if `alpha`) pixels of each frame
+    are streamed to the file or named pipe `name` ('-' for stdout) by
+    `RawFrameAnimation`.  With `alpha`, the background is transparent.
+
+    If `shard` ('K/N') or `frame_range` ('A:B') is set and `save` is 'gif' or
+    'mp4', only that contiguous range of frames is rendered and saved as a
+    part file (`{name}.part-{start}-{stop}.{ext}`).  The timeline is fully
+    determined by `func` so separate processes or machines can each render a
+    part.  Once all parts exist, `merge` concatenates them into
+    `{name}.{ext}` without re-encoding.  GIF parts always use the fixed scene
+    palette of `optimize_gif` so they can be concatenated.
+
+    Raw output and parts are not rendered through the frame store, caches,
+    or GIF optimization so `resume`, `cache_dir`, `clip_library`, and
+    `optimize_gif` raise ValueError with them (as do parts of raw output).
+    '''
+    check_save_options(save, resume=resume, cache_dir=cache_dir,
+                       clip_library=clip_library, optimize_gif=optimize_gif,
+                       shard=shard, frame_range=frame_range, merge=merge)
+    frame_args = dict(draw_args or {}, style=style)
     def wrapper(func):
-        if save == 'mp4':
+        ext = 'mp4' if save == 'mp4' else 'gif'
+        if save and save != 'raw' and (shard or frame_range or merge):
+            make_state = lambda anim: AnimState(
+                anim, fps=fps, draw_args=dict(frame_args))
+            total = shards.count_frames(func, make_state)
+            if merge:
+                shards.merge_parts(name, ext, total)
+            else:
+                start, stop = shards.frame_range(total, shard, frame_range)
+                anim = shards.RangeFrameAnimation(start, stop, draw_frame)
+                func(make_state(anim))
+                if start < stop:
+                    shards.save_part(anim.raster_frames, name, start, stop,
+                                     ext, fps=fps, colors=SCENE_COLORS)
+        elif save == 'raw':
+            anim = RawFrameAnimation(name, draw_frame, fps=fps, alpha=alpha)
+            raw_args = dict(frame_args)
+            if alpha:
+                # Transparent background
+                raw_args['background'] = None
+            state = AnimState(anim, fps=fps, draw_args=raw_args)
+            try:
+                func(state)
+            finally:
+                anim.close()
+        elif save and clip_library:
+            anim = ClipLibraryAnimation(clip_library, draw_frame, ext=ext,
+                                        fps=fps, colors=SCENE_COLORS)
+            state = AnimState(anim, fps=fps, draw_args=dict(frame_args))
+            try:
+                func(state)
+                anim.save(f'{name}.{ext}')
+            finally:
+                anim.close()
+        elif save and (cache_dir or resume or optimize_gif):
+            store = None
+            if cache_dir:
+                anim = SegmentCacheAnimation(cache_dir, draw_frame)
+            elif resume:
+                meta = dict(fps=fps, style=style, key=resume,
+                            draw_args=frame_args)
+                store = FrameStore(f'{name}.{ext}.frames', meta=meta)
+                anim = StoredFrameAnimation(store, draw_frame)
+            else:
+                anim = draw.FrameAnimation(draw_frame)
+            state = AnimState(anim, fps=fps, draw_args=dict(frame_args))
+            func(state)
+            if store is not None:
+                frames = store.frames()
+            else:
+                frames = getattr(anim, 'raster_frames', anim.frames)
+            save_frames(frames, f'{name}.{ext}', fps=fps,
+                        optimize_gif=optimize_gif)
+            if store is not None:
+                store.remove()
+        elif save == 'mp4':
             with draw.frame_animate_video(
                     f'{name}.mp4', draw_frame, fps=fps, jupyter=preview
                     ) as anim:
-                state = AnimState(anim, fps=fps, draw_args={"style": style})
+                state = AnimState(anim, fps=fps, draw_args=dict(frame_args))
                 func(state)
         elif save == 'gif' or save is True:
             with draw.frame_animate_video(
                     f'{name}.gif', draw_frame, duration=1/fps, jupyter=preview
                     ) as anim:
-                state = AnimState(anim, fps=fps, draw_args={"style": style})
+                state = AnimState(anim, fps=fps, draw_args=dict(frame_args))
                 func(state)
         else:
             with draw.frame_animate_jupyter(draw_frame, delay=1/fps) as anim:
-                state = AnimState(anim, fps=fps, draw_args={"style": style})
+                state = AnimState(anim, fps=fps, draw_args=dict(frame_args))
                 func(state)
         return func
     return wrapper
 
+def build_clip_library(library_dir, fps=20, style='sphere', waits=(1,),
+                       draw_args=None, save='gif'):
+    '''Renders every named gate of `AnimState`, the given waits, and the
+    sphere fades from each Clifford orientation into `library_dir` for use
+    with `do_or_save_animation(..., clip_library=library_dir)` with the same
+    `save` format ('gif' or 'mp4'), `fps`, `style`, and `draw_args` (e.g. the
+    output size `w`).  Clips already in the library are not rendered
+    again.'''
+    frame_args = dict(draw_args or {}, style=style)
+    gates = [name for name in dir(AnimState)
+             if name.endswith('_gate')
+             and name not in ('do_gate', 'custom_gate')]
+    anim = ClipLibraryAnimation(library_dir, draw_frame,
+                                ext='mp4' if save == 'mp4' else 'gif',
+                                fps=fps, colors=SCENE_COLORS)
+    def start_states():
+        for rotation in CLIFFORD_ROTATIONS:
+            yield AnimState(anim, fps=fps,
+                            inner_proj=euclid3d.LinearProjection(rotation),
+                            draw_args=dict(frame_args))
+    for state in start_states():
+        state.sphere_fade_in()
+    for name in gates:
+        for state in start_states():
+            getattr(state, name)()
+    for duration in waits:
+        for state in start_states():
+            state.wait(duration)
+    for state in start_states():
+        state.sphere_fade_out()
+
+def save_frames(frames, file, fps=20, optimize_gif=False):
+    '''Saves drawings or RGB arrays as a GIF or MP4 video depending on the
+    file extension.
+
+    If `optimize_gif` is set, GIFs are encoded with a fixed palette of the
+    scene colors and only the changed part of each frame is stored.
+    '''
+    if optimize_gif and file.endswith('.gif'):
+        rasters = (f if isinstance(f, np.ndarray) else rasterize_frame(f)
+                   for f in frames)
+        size, seconds = gif.save_gif(rasters, file, fps=fps,
+                                     colors=SCENE_COLORS)
+        print(f'Encoded "{file}" ({size/1024:.1f} KiB) in {seconds:.2f} s')
+    elif file.endswith('.gif'):
+        draw.video.save_video(frames, file, duration=1/fps)
+    else:
+        draw.video.save_video(frames, file, fps=fps)
+
 def draw_frame(*args, background='white', id_prefix='d', w=624, h=None,
-               **kwargs):
+               lod=True, **kwargs):
     d = draw.Drawing(5, 3, origin='center', id_prefix=id_prefix)
     d.set_render_size(w=w, h=h)
     if background:
         d.append(draw.Rectangle(-100, -100, 200, 200, fill=background))
 
+    px_per_unit = None
+    if lod and (w is not None or h is not None):
+        px_per_unit = min(w/5 if w is not None else np.inf,
+                          h/3 if h is not None else np.inf)
     g = draw.Group()
-    draw_bloch_sphere(g, background=None, *args, **kwargs)
+    draw_bloch_sphere(g, background=None, *args, px_per_unit=px_per_unit,
+                      **kwargs)
     d.append(g)
     return d
 
@@ -221,7 +642,16 @@ def draw_bloch_sphere(d, inner_proj=euclid3d.identity(3), label='', axis=None,
                       rot_proj=None, rot_deg=180,
                       outer_labels=(), inner_labels=(),
                       extra_opacity=1, inner_opacity=1, background='white',
-                      style='sphere'):
+                      style='sphere', px_per_unit=None, points=None,
+                      point_args=None):
+    '''Draws the Bloch sphere into `d`.
+
+    If `px_per_unit` (output pixels per drawing unit) is given and small, a
+    lower level of detail is drawn (see `LOD_PX_PER_UNIT`).
+
+    `points` is an optional N x 3 array of Bloch vectors to overlay, drawn by
+    `draw_point_cloud` with `point_args`.
+    '''
     spin = euclid3d.rotation(3, 0, 2, 2*np.pi/16/2*1.001)
     tilt = euclid3d.rotation(3, 1, 2, np.pi/8)
     trans = tilt @ spin @ euclid3d.axis_swap((1, 2, 0))
@@ -237,6 +667,23 @@ def draw_bloch_sphere(d, inner_proj=euclid3d.identity(3), label='', axis=None,
     if background:
         d.append(draw.Rectangle(-100, -100, 200, 200, fill=background))
 
+    lod = px_per_unit is not None and px_per_unit < LOD_PX_PER_UNIT
+    def visible(size, min_px):
+        return not lod or size * px_per_unit >= min_px
+
+    def arc_polyline(proj, r, start, end):
+        # Enough points that the chords are within LOD_ARC_ERROR_PX
+        quad = np.array([[-1, -1, 1, 1], [-1, 1, 1, -1]]).T
+        corners = proj.project_list(quad*r)[:, :2]
+        r_px = np.abs(corners - corners.mean(axis=0)).max() * px_per_unit
+        cos_half = 1 - LOD_ARC_ERROR_PX / max(r_px, LOD_ARC_ERROR_PX)
+        n = int(np.ceil((end-start) / (2*np.arccos(cos_half)))) or 1
+        t = np.linspace(start, end, n+1)
+        pts = proj.project_list(np.stack([np.cos(t), np.sin(t)], axis=1) * r)
+        # Round to the coarsest power of ten drawing units that is at most a
+        # tenth of a pixel to keep the SVG small
+        return np.round(pts[:, :2], int(np.ceil(np.log10(px_per_unit*10))))
+
     def draw_band(proj, trans, r_outer=1, r_inner=0.9, color='black', z_mul=1,
                   opacity=1, divs=4, d=d, **kwargs):
         color = ((color * divs)[:divs] if isinstance(color, list)
@@ -244,6 +691,10 @@ def draw_bloch_sphere(d, inner_proj=euclid3d.identity(3), label='', axis=None,
         points = np.array([[-1, -1, 1, 1], [-1, 1, 1, -1]]).T
         sqr12 = 0.5**0.5
         overlap = np.pi/500 * (divs != 4)
+        start_end_angles = [
+            (pr-2*np.pi/divs-overlap, pr+overlap)
+            for pr in np.linspace(0, 2*np.pi, num=divs, endpoint=False)
+        ]
         start_end_points = [
             np.array([[np.cos(pr-2*np.pi/divs-overlap),
                        np.sin(pr-2*np.pi/divs-overlap)],
@@ -256,6 +707,18 @@ def draw_bloch_sphere(d, inner_proj=euclid3d.identity(3), label='', axis=None,
                           **kwargs, opacity=opacity)
             z = trans.project_point(
                 (r_inner+r_outer)/2*start_end_points[i][2])[2]
+            if lod:
+                outer = arc_polyline(proj, r_outer, *start_end_angles[i])
+                p.M(*outer[0])
+                for pt in outer[1:]:
+                    p.L(*pt)
+                if r_inner > 0:
+                    inner = arc_polyline(proj, r_inner, *start_end_angles[i])
+                    for pt in inner[::-1]:
+                        p.L(*pt)
+                p.Z()
+                d.append(p, z=z*z_mul)
+                continue
             e = shapes.EllipseArc.from_bounding_quad(
                 *proj.project_list(points*r_outer)[:, :2].flatten(),
                 *proj.project_list(start_end_points[i]*r_outer
@@ -281,13 +744,13 @@ def draw_bloch_sphere(d, inner_proj=euclid3d.identity(3), label='', axis=None,
                 ), fill='none', stroke_width=0.02, stroke=color[i], **kwargs,
                 z=z*z_mul)
 
-    xycolors = ['#56e', '#239', '#56e', '#56e']
-    yzcolors = ['#e1e144', '#909022', '#e1e144', '#e1e144']
-    zxcolors = ['#9e2', '#6a1', '#9e2', '#9e2']
+    xycolors = XY_COLORS
+    yzcolors = YZ_COLORS
+    zxcolors = ZX_COLORS
 
-    draw_band(proj_xy, trans@xy, 1, 0.925, z_mul=10, color=xycolors)
-    draw_band(proj_yz, trans@yz, 1, 0.925, z_mul=10, color=yzcolors)
-    draw_band(proj_zx, trans@zx, 1, 0.925, z_mul=10, color=zxcolors)
+    draw_band(proj_xy, trans@xy, 1, 0.925, z_mul=OUTER_Z_MUL, color=xycolors)
+    draw_band(proj_yz, trans@yz, 1, 0.925, z_mul=OUTER_Z_MUL, color=yzcolors)
+    draw_band(proj_zx, trans@zx, 1, 0.925, z_mul=OUTER_Z_MUL, color=zxcolors)
 
     # Inner
     g = draw.Group(opacity=inner_opacity)
@@ -340,6 +803,8 @@ def draw_bloch_sphere(d, inner_proj=euclid3d.identity(3), label='', axis=None,
                            marker_end=arrow),
                 z=z_center)
         for pt, (x_off, y_off), elem in inner_labels:
+            if not visible(0.2, LOD_MIN_TEXT_PX):
+                break
             x, y = (proj@inner_proj).p2(*pt)
             g.append(draw.Use(elem, x+x_off, y+y_off), z=10000)
 
@@ -354,6 +819,9 @@ def draw_bloch_sphere(d, inner_proj=euclid3d.identity(3), label='', axis=None,
                       r_outer=r-0.01, r_inner=r+0.01, color='#bbb', opacity=1,
                       d=g)
 
+    if points is not None:
+        draw_point_cloud(d, points, proj, trans, **(point_args or {}))
+
     # Outer arrows and text
     arrow = draw.Marker(-0.1, -0.5, 0.9, 0.5, scale=4, orient='auto')
     arrow.append(draw.Lines(-0.1, 0.5, -0.1, -0.5, 0.9, 0, fill='black',
@@ -373,18 +841,19 @@ def draw_bloch_sphere(d, inner_proj=euclid3d.identity(3), label='', axis=None,
                        stroke='black', stroke_width=0.02))
     d.append(draw.Line(*proj_xy.p2(0, 0, -1), *proj_xy.p2(0, 0, -1.2),
                        stroke='black', stroke_width=0.02))
-    d.append(draw.Text(['X'], 0.2, *proj_xy.p2(1.7, 0, 0), center=True,
-                       fill='black'), z=100)
-    d.append(draw.Text(['Y'], 0.2, *proj_xy.p2(0, 1.35, 0), center=True,
-                       fill='black'), z=100)
-    d.append(draw.Text(['Z'], 0.2, *proj_xy.p2(0, 0, 1.4), center=True,
-                       fill='black'), z=100)
-    for pt, (x_off, y_off), elem in outer_labels:
-        x, y = proj.p2(*pt)
-        d.append(draw.Use(elem, x+x_off, y-y_off), z=10000)
+    if visible(0.2, LOD_MIN_TEXT_PX):
+        d.append(draw.Text(['X'], 0.2, *proj_xy.p2(1.7, 0, 0), center=True,
+                           fill='black'), z=100)
+        d.append(draw.Text(['Y'], 0.2, *proj_xy.p2(0, 1.35, 0), center=True,
+                           fill='black'), z=100)
+        d.append(draw.Text(['Z'], 0.2, *proj_xy.p2(0, 0, 1.4), center=True,
+                           fill='black'), z=100)
+        for pt, (x_off, y_off), elem in outer_labels:
+            x, y = proj.p2(*pt)
+            d.append(draw.Use(elem, x+x_off, y-y_off), z=10000)
 
     # Extra annotations
-    if label:
+    if label and visible(0.4, LOD_MIN_TEXT_PX):
         d.append(draw.Text([label], 0.4, -0.6, -1.2, center=True, fill='#c00',
                            text_anchor='end',
                            opacity=extra_opacity))
@@ -401,9 +870,9 @@ def draw_bloch_sphere(d, inner_proj=euclid3d.identity(3), label='', axis=None,
                            stroke='#e00', stroke_width=0.04, marker_end=arrow))
         d.append(g, z=z)
 
-    if rot_proj is not None:
+    r_inner, r_outer = 0.1, 0.16
+    if rot_proj is not None and visible(2*r_outer, LOD_MIN_ROT_PX):
         rot_proj =  inner_proj @ rot_proj
-        r_inner, r_outer = 0.1, 0.16
         points = np.array([[-1, -1, 1, 1], [-1, 1, 1, -1]]).T
         start_end_points = np.array([[1, 0], [-1, 0], [0, 1]])
         p = draw.Path(fill='orange', fill_rule='nonzero', opacity=extra_opacity)
@@ -433,14 +902,89 @@ def draw_bloch_sphere(d, inner_proj=euclid3d.identity(3), label='', axis=None,
 
     return d
 
+def draw_point_cloud(d, points, proj, trans, color='#c00', radius=0.015,
+                     opacity=1, max_points=5000, depth_layers=8, bins=64,
+                     levels=8):
+    '''Draws Bloch vectors (an N x 3 array) as dots.
+
+    All points are projected at once and split into `depth_layers` layers by
+    their depth in `trans` (scaled like the outer bands) so they sort between
+    the sphere bands.  Each layer is a single SVG path.
+
+    With more than `max_points` points, a density heatmap of `bins` x `bins`
+    cells with `levels` opacity levels is drawn instead, split into the
+    halves in front of and behind the sphere center.
+    '''
+    points = np.asarray(points, dtype=float).reshape(-1, 3)
+    if len(points) == 0:
+        return
+    xy = proj.project_list(points)[:, :2]
+    z = trans.project_list(points)[:, 2]
 
-def main(name, gates, mp4=False, fps=20, preview=False, style='sphere'):
+    if len(points) <= max_points:
+        edges = np.linspace(z.min(), z.max(), depth_layers+1)[1:-1]
+        layers = np.searchsorted(edges, z)
+        for layer in np.unique(layers):
+            in_layer = layers == layer
+            layer_xy = xy[in_layer]
+            path = ('M%.4f,%.4fh0' * len(layer_xy)) % tuple(layer_xy.ravel())
+            d.append(draw.Path(d=path, fill='none', stroke=color,
+                               stroke_width=2*radius, stroke_linecap='round',
+                               opacity=opacity),
+                     z=OUTER_Z_MUL*z[in_layer].mean())
+        return
+
+    z_center = trans.project_point((0, 0, 0))[2]
+    front = z >= z_center
+    extent = np.abs(xy).max()
+    cell = 2*extent/bins
+    counts = [
+        np.histogram2d(xy[half, 0], xy[half, 1], bins=bins,
+                       range=[[-extent, extent]]*2)[0]
+        for half in (~front, front)
+    ]
+    max_count = max(c.max() for c in counts)
+    cell_fmt = f'M%.4f,%.4fh{cell:.4f}v{cell:.4f}h{-cell:.4f}z'
+    for z_off, count in zip((-0.5, 0.5), counts):
+        count_levels = np.ceil(count / max_count * levels).astype(int)
+        for level in range(1, levels+1):
+            ix, iy = np.nonzero(count_levels == level)
+            if len(ix) == 0:
+                continue
+            corners = np.stack([ix, iy], axis=1) * cell - extent
+            path = (cell_fmt * len(corners)) % tuple(corners.ravel())
+            d.append(draw.Path(d=path, fill=color, stroke='none',
+                               opacity=opacity*level/levels),
+                     z=OUTER_Z_MUL*(z_center+z_off))
+
+
+def main(name, gates, mp4=False, fps=20, preview=False, style='sphere',
+         resume=False, cache_dir=None, optimize_gif=False, output=None,
+         alpha=False, shard=None, frame_range=None, merge=False,
+         clip_library=None, width=None, height=None):
     save = 'mp4' if mp4 else 'gif'
+    draw_args = {key: value for key, value in dict(w=width, h=height).items()
+                 if value is not None}
+    if output is not None:
+        save = 'raw'
+        name = output
     @do_or_save_animation(name, save=save, fps=fps, preview=preview,
-                          style=style)
+                          style=style, resume=resume and list(gates),
+                          cache_dir=cache_dir, optimize_gif=optimize_gif,
+                          alpha=alpha, shard=shard, frame_range=frame_range,
+                          merge=merge, clip_library=clip_library,
+                          draw_args=draw_args)
     def animate(state):
         state.apply_gate_list(gates)
-    print(f'Saved "{name}.{save}" with gate sequence "{"".join(gates)}"')
+    if (shard or frame_range) and not merge:
+        print(f'Saved part of "{name}.{save}" with gate sequence '
+              f'"{"".join(gates)}"')
+    elif output is not None:
+        # Stdout may be the frame stream
+        print(f'Wrote raw frames to "{output}" with gate sequence '
+              f'"{"".join(gates)}"', file=sys.stderr)
+    else:
+        print(f'Saved "{name}.{save}" with gate sequence "{"".join(gates)}"')
 
 def run_from_command_line():
     parser = argparse.ArgumentParser(
@@ -457,9 +1001,84 @@ def run_from_command_line():
     parser.add_argument('--style', type=str, choices=['sphere', 'arrows'],
         default='sphere', help='The style to draw the Bloch sphere. E.g. '
         'draw the whole sphere or just draw the axis arrows.')
+    parser.add_argument('--width', type=int, help=
+        'Output width in pixels (default: 624)')
+    parser.add_argument('--height', type=int, help=
+        'Maximum output height in pixels')
+    parser.add_argument('--resume', action='store_true', help=
+        'Checkpoint rendered frames to disk and resume an interrupted render')
+    parser.add_argument('--cache-dir', type=str, help=
+        'Directory to cache rendered gates in so only edited parts of a gate '
+        'sequence are rendered again')
+    parser.add_argument('--clip-library', type=str, help=
+        'Directory of gate clips rendered from each Clifford orientation.  '
+        'Clifford gate sequences are assembled from the stored clips and '
+        'missing clips are added.')
+    parser.add_argument('--optimize-gif', action='store_true', help=
+        'Encode a smaller GIF with a fixed palette and inter-frame deltas')
+    parser.add_argument('--output', type=str, help=
+        'Stream raw RGB frames to this file or named pipe ("-" for stdout) '
+        'instead of saving a GIF or mp4.  The frame size and rate are written '
+        'to OUTPUT.json (or stderr).')
+    parser.add_argument('--alpha', action='store_true', help=
+        'Stream RGBA instead of RGB frames with --output')
+    add_shard_arguments(parser)
     args = parser.parse_args()
+    check_option_arguments(parser, args)
     main(name=args.name, gates=args.gate, mp4=args.mp4, fps=args.fps,
-         style=args.style)
+         style=args.style, resume=args.resume, cache_dir=args.cache_dir,
+         optimize_gif=args.optimize_gif, output=args.output, alpha=args.alpha,
+         shard=args.shard, frame_range=args.frames, merge=args.merge,
+         clip_library=args.clip_library, width=args.width,
+         height=args.height)
+
+def add_shard_arguments(parser):
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument('--shard', type=str, help=
+        'Only render part K of N equal parts of the animation (K/N, counting '
+        'from 0) and save it as NAME.part-START-STOP.gif (or .mp4)')
+    group.add_argument('--frames', type=str, help=
+        'Only render frames A to B (A:B, excluding B) and save them as a part')
+    group.add_argument('--merge', action='store_true', help=
+        'Concatenate the saved parts into NAME.gif (or .mp4) without '
+        're-encoding')
+
+# Raw output and parts are not rendered with STORE_OPTIONS and raw output is
+# not split into PART_OPTIONS
+STORE_OPTIONS = ('resume', 'cache_dir', 'clip_library', 'optimize_gif')
+PART_OPTIONS = ('shard', 'frame_range', 'merge')
+
+def unsupported_options(save, **options):
+    '''Returns the names of the set `options` that are not supported when
+    saving as `save`.'''
+    names = [name for name, value in options.items() if value]
+    if save == 'raw':
+        return [name for name in names
+                if name in STORE_OPTIONS + PART_OPTIONS]
+    if save and any(name in PART_OPTIONS for name in names):
+        return [name for name in names if name in STORE_OPTIONS]
+    return []
+
+def check_save_options(save, **options):
+    unsupported = unsupported_options(save, **options)
+    if unsupported:
+        raise ValueError('{} can not be used with {}.'.format(
+            ', '.join(unsupported),
+            'raw output' if save == 'raw' else 'shard, frame_range, or merge'))
+
+def check_option_arguments(parser, args):
+    '''Exits with a usage error if command line options would be ignored.'''
+    flags = dict(resume='--resume', cache_dir='--cache-dir',
+                 clip_library='--clip-library', optimize_gif='--optimize-gif',
+                 shard='--shard', frame_range='--frames', merge='--merge')
+    save = 'raw' if args.output is not None else 'mp4' if args.mp4 else 'gif'
+    unsupported = unsupported_options(save, **{
+        name: getattr(args, flag[2:].replace('-', '_'), None)
+        for name, flag in flags.items()})
+    if unsupported:
+        parser.error('{} can not be used with {}'.format(
+            ', '.join(flags[name] for name in unsupported),
+            '--output' if save == 'raw' else '--shard, --frames, or --merge'))
 
 if __name__ == '__main__':
     run_from_command_line()
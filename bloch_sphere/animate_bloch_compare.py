@@ -1,29 +1,109 @@
 
 import argparse
+import sys
+
+import numpy as np
 
 import drawsvg as draw
 import latextools
 
-from bloch_sphere import animate_bloch
+from bloch_sphere import animate_bloch, shards
+from bloch_sphere.frame_store import (
+    FrameStore, StoredFrameAnimation, rasterize_frame)
+from bloch_sphere.raw_output import RawFrameAnimation
 
 
 def render_animation(name, func1, func2, circuit_qcircuit='', equation_latex='',
                      save=False, fps=20, preview=True, style='sphere',
-                     **kwargs):
+                     shard=None, frame_range=None, merge=False, **kwargs):
+    animate_bloch.check_save_options(
+        save, resume=kwargs.get('resume'),
+        optimize_gif=kwargs.get('optimize_gif'), shard=shard,
+        frame_range=frame_range, merge=merge)
+    # Draw each sphere at its size in the whole frame for the level of detail
+    w, h = kwargs.get('w', 624*2), kwargs.get('h')
+    px_per_unit = min(w/10 if w is not None else np.inf,
+                      h/4 if h is not None else np.inf)
+    draw_args = {"style": style}
+    if np.isfinite(px_per_unit):
+        draw_args['w'] = 5*px_per_unit
+
+    if save and save != 'raw' and (shard or frame_range or merge):
+        render_part(name, func1, func2, circuit_qcircuit, equation_latex,
+                    save=save, fps=fps, draw_args=draw_args, shard=shard,
+                    frame_range=frame_range, merge=merge, **kwargs)
+        return
+
+    if save == 'raw':
+        # Only record the draw calls and draw both spheres as each output
+        # frame is written
+        frames1, frames2 = (
+            _draw_lazily(func, fps=fps, draw_args=draw_args)
+            for func in (func1, func2))
+        extra_elements = draw_extra_elements(circuit_qcircuit, equation_latex)
+        save_side_by_side(name, frames1, frames2,
+                          extra_elements=extra_elements, save=save, fps=fps,
+                          preview=preview, **kwargs)
+        return
+
     with draw.frame_animation.FrameAnimationContext(
             animate_bloch.draw_frame, jupyter=preview, delay=0) as anim:
         state = animate_bloch.AnimState(
-                anim, fps=fps, draw_args={"style": style})
+                anim, fps=fps, draw_args=dict(draw_args))
         func1(state)
     frames1 = anim.frames
 
     with draw.frame_animation.FrameAnimationContext(
             animate_bloch.draw_frame, jupyter=preview, delay=0) as anim:
         state = animate_bloch.AnimState(
-                anim, fps=fps, draw_args={"style": style})
+                anim, fps=fps, draw_args=dict(draw_args))
         func2(state)
     frames2 = anim.frames
 
+    extra_elements = draw_extra_elements(circuit_qcircuit, equation_latex)
+    save_side_by_side(name, frames1, frames2, extra_elements=extra_elements,
+                      save=save, fps=fps, preview=preview, **kwargs)
+
+def _draw_lazily(func, fps=20, draw_args=None):
+    anim = draw.FrameAnimation(lambda *args, **kwargs: (args, kwargs))
+    func(animate_bloch.AnimState(anim, fps=fps, draw_args=dict(draw_args)))
+    return (animate_bloch.draw_frame(*args, **kwargs)
+            for args, kwargs in anim.frames)
+
+def render_part(name, func1, func2, circuit_qcircuit='', equation_latex='',
+                save='gif', fps=20, draw_args=None, shard=None,
+                frame_range=None, merge=False, resume=False,
+                optimize_gif=False, alpha=False, **kwargs):
+    '''Saves one part of the side by side animation (or merges the parts).
+    Frames are counted without drawing and only the sphere frames shown in
+    the part are drawn.  GIF parts always use the fixed scene palette.'''
+    ext = 'mp4' if save == 'mp4' else 'gif'
+    make_state = lambda anim: animate_bloch.AnimState(
+        anim, fps=fps, draw_args=dict(draw_args or {}))
+    counts = [shards.count_frames(func, make_state) for func in (func1, func2)]
+    total = max(counts)
+    if merge:
+        shards.merge_parts(name, ext, total)
+        return
+    start, stop = shards.frame_range(total, shard, frame_range)
+    if start >= stop:
+        return
+    sphere_frames = []
+    for func, count in zip((func1, func2), counts):
+        # The shorter animation is padded with its last frame
+        indices = [min(i, count-1) for i in range(start, stop)]
+        anim = shards.SparseFrameAnimation(indices, animate_bloch.draw_frame)
+        func(make_state(anim))
+        sphere_frames.append([anim.drawn[i] for i in indices])
+    extra_elements = draw_extra_elements(circuit_qcircuit, equation_latex)
+    frames = [rasterize_frame(draw_whole_frame(
+                  f1, f2, background='white', extra_elements=extra_elements,
+                  **kwargs))
+              for f1, f2 in zip(*sphere_frames)]
+    shards.save_part(frames, name, start, stop, ext, fps=fps,
+                     colors=animate_bloch.SCENE_COLORS)
+
+def draw_extra_elements(circuit_qcircuit='', equation_latex=''):
     g = draw.Group()
     # Equals sign
     g.append(draw.Rectangle(-0.4, -0.15, 0.8, 0.075, fill='#000'))
@@ -35,10 +115,7 @@ def render_animation(name, func1, func2, circuit_qcircuit='', equation_latex='',
         equation_elem = latextools.render_snippet(
             equation_latex, latextools.pkg.qcircuit).as_svg()
         g.draw(equation_elem, x=0, y=0.8, center=True, scale=0.03)
-    extra_elements = (g,)
-
-    save_side_by_side(name, frames1, frames2, extra_elements=extra_elements,
-                      save=save, fps=fps, preview=preview, **kwargs)
+    return (g,)
 
 def zip_pad(*iterables):
     '''Same as the builtin zip but pads shorter iterables with their last
@@ -62,7 +139,30 @@ def zip_pad(*iterables):
         yield values
 
 def save_side_by_side(name: str, frames1, frames2, extra_elements=(),
-                      save=False, fps=20, preview=True, **kwargs):
+                      save=False, fps=20, preview=True, resume=False,
+                      optimize_gif=False, alpha=False, **kwargs):
+    if save == 'raw':
+        # Stream frames to the file or named pipe `name` ('-' for stdout)
+        anim = RawFrameAnimation(name, draw_whole_frame, fps=fps, alpha=alpha)
+        try:
+            for f1, f2 in zip_pad(frames1, frames2):
+                anim.draw_frame(f1, f2, background=None if alpha else 'white',
+                                extra_elements=extra_elements, **kwargs)
+        finally:
+            anim.close()
+        return
+    if save and resume:
+        ext = 'mp4' if save == 'mp4' else 'gif'
+        store = FrameStore(f'{name}.{ext}.frames',
+                           meta=dict(fps=fps, key=resume, draw_args=kwargs))
+        anim = StoredFrameAnimation(store, draw_whole_frame)
+        for f1, f2 in zip_pad(frames1, frames2):
+            anim.draw_frame(f1, f2, background='white',
+                            extra_elements=extra_elements, **kwargs)
+        animate_bloch.save_frames(store.frames(), f'{name}.{ext}', fps=fps,
+                                  optimize_gif=optimize_gif)
+        store.remove()
+        return
     with draw.frame_animation.FrameAnimationContext(
             draw_whole_frame, jupyter=not save or preview,
             delay=0 if save else 1/fps) as anim:
@@ -72,7 +172,8 @@ def save_side_by_side(name: str, frames1, frames2, extra_elements=(),
     if save == 'mp4':
         anim.save_video(f'{name}.mp4', fps=fps)
     elif save == 'gif' or save is True:
-        anim.save_video(f'{name}.gif', duration=1/fps)
+        animate_bloch.save_frames(anim.frames, f'{name}.gif', fps=fps,
+                                  optimize_gif=optimize_gif)
 
 def draw_whole_frame(f1, f2, background='white', w=624*2, h=None,
                      extra_elements=()):
@@ -87,14 +188,26 @@ def draw_whole_frame(f1, f2, background='white', w=624*2, h=None,
     d.extend(extra_elements)
     return d
 
+def _gates_key(gates):
+    if isinstance(gates, animate_bloch.Rotations):
+        return gates.as_json()
+    return list(gates)
+
 def main(name, gates1, gates2, circuit_qcircuit='', equation_latex='',
-         mp4=False, fps=20, preview=False, style='sphere'):
+         mp4=False, fps=20, preview=False, style='sphere', resume=False,
+         optimize_gif=False, output=None, alpha=False, shard=None,
+         frame_range=None, merge=False):
+    '''Renders `gates1` and `gates2` side by side.  Each is a list of gate
+    names or an `animate_bloch.Rotations`.'''
     save = 'mp4' if mp4 else 'gif'
+    if output is not None:
+        save = 'raw'
+        name = output
     def func1(state):
         state.sphere_fade_in()
         state.apply_gate_list(gates1, final_wait=False)
         state.wait()
-        for _ in gates2:
+        for _ in range(len(gates2)):
             state.i_gate()
         state.wait()
         state.wait()
@@ -102,7 +215,7 @@ def main(name, gates1, gates2, circuit_qcircuit='', equation_latex='',
         state.wait()
     def func2(state):
         state.sphere_fade_in()
-        for _ in gates1:
+        for _ in range(len(gates1)):
             state.i_gate()
         state.wait()
         state.apply_gate_list(gates2, final_wait=False)
@@ -111,8 +224,19 @@ def main(name, gates1, gates2, circuit_qcircuit='', equation_latex='',
         state.sphere_fade_out()
         state.wait()
     render_animation(name, func1, func2, circuit_qcircuit, equation_latex,
-                     save=save, fps=fps, preview=preview, style=style)
-    print(f'Saved "{name}.{save}"')
+                     save=save, fps=fps, preview=preview, style=style,
+                     resume=resume and [_gates_key(gates1), _gates_key(gates2),
+                                        style, circuit_qcircuit,
+                                        equation_latex],
+                     optimize_gif=optimize_gif, alpha=alpha, shard=shard,
+                     frame_range=frame_range, merge=merge)
+    if (shard or frame_range) and not merge:
+        print(f'Saved part of "{name}.{save}"')
+    elif output is not None:
+        # Stdout may be the frame stream
+        print(f'Wrote raw frames to "{output}"', file=sys.stderr)
+    else:
+        print(f'Saved "{name}.{save}"')
 
 def run_from_command_line():
     parser = argparse.ArgumentParser(
@@ -136,11 +260,25 @@ def run_from_command_line():
     parser.add_argument('--style', type=str, choices=['sphere', 'arrows'],
         default='sphere', help='The style to draw the Bloch sphere. E.g. '
         'draw the whole sphere or just draw the axis arrows.')
+    parser.add_argument('--resume', action='store_true', help=
+        'Checkpoint rendered frames to disk and resume an interrupted render')
+    parser.add_argument('--optimize-gif', action='store_true', help=
+        'Encode a smaller GIF with a fixed palette and inter-frame deltas')
+    parser.add_argument('--output', type=str, help=
+        'Stream raw RGB frames to this file or named pipe ("-" for stdout) '
+        'instead of saving a GIF or mp4.  The frame size and rate are written '
+        'to OUTPUT.json (or stderr).')
+    parser.add_argument('--alpha', action='store_true', help=
+        'Stream RGBA instead of RGB frames with --output')
+    animate_bloch.add_shard_arguments(parser)
     args = parser.parse_args()
+    animate_bloch.check_option_arguments(parser, args)
     main(name=args.name, gates1=args.gates1.split(','),
          gates2=args.gates2.split(','),
          circuit_qcircuit=args.circuit, equation_latex=args.equation,
-         mp4=args.mp4, fps=args.fps, style=args.arrow_style)
+         mp4=args.mp4, fps=args.fps, style=args.style, resume=args.resume,
+         optimize_gif=args.optimize_gif, output=args.output, alpha=args.alpha,
+         shard=args.shard, frame_range=args.frames, merge=args.merge)
 
 if __name__ == '__main__':
     run_from_command_line()
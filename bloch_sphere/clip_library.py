@@ -0,0 +1,222 @@
+'''A library of rendered gate clips for every single-qubit Clifford
+orientation of the Bloch sphere.
+
+Fixed gates (e.g. h, x, s, sqrt_y) map the 24 Clifford orientations onto each
+other so a gate sequence made of them only ever needs the clips of each
+gate from each of the 24 starting orientations.  Each clip is stored encoded
+(a GIF with a fixed palette or an mp4) and once they are rendered, such
+sequences are assembled by concatenating the clip files without re-encoding
+them (like the parts in `shards`).
+'''
+
+import itertools
+import os
+import shutil
+import sys
+import tempfile
+
+import numpy as np
+
+import drawsvg as draw
+
+from bloch_sphere import gif, shards
+from bloch_sphere.frame_store import rasterize_frame
+from bloch_sphere.segment_cache import (
+    prune_versions, render_version, segment_key)
+
+
+def _clifford_rotations():
+    rotations = []
+    for perm in itertools.permutations(range(3)):
+        for signs in itertools.product((1, -1), repeat=3):
+            m = np.zeros((3, 3))
+            m[range(3), perm] = signs
+            if np.linalg.det(m) > 0:
+                rotations.append(m)
+    return tuple(rotations)
+
+# The 24 rotations that permute the X, Y, and Z axes (the single-qubit
+# Clifford group up to global phase)
+CLIFFORD_ROTATIONS = _clifford_rotations()
+
+# Segments that can be stored besides gates
+CLIP_SEGMENTS = {'wait', 'sphere_fade_in', 'sphere_fade_out'}
+
+def clifford_index(proj, tol=1e-6):
+    '''Returns the index in `CLIFFORD_ROTATIONS` of the orientation
+    `proj` or None if it is not a Clifford orientation.'''
+    offset = getattr(proj, 'offset', None)
+    if offset is not None and np.any(np.abs(offset) > tol):
+        return None
+    matrix = np.asarray(proj.matrix, dtype=float)
+    if matrix.shape != (3, 3):
+        return None
+    for i, rotation in enumerate(CLIFFORD_ROTATIONS):
+        if np.all(np.abs(matrix - rotation) <= tol):
+            return i
+    return None
+
+
+class ClipLibraryAnimation(draw.FrameAnimation):
+    '''A `FrameAnimation` that stores named fixed gates (e.g. h, s, t),
+    waits, and sphere fades starting from a Clifford orientation as encoded
+    clips in `library_dir`, keyed by that orientation instead of the exact
+    matrix so the clips are found no matter which gates led there.  Other
+    segments (e.g. custom or Rx/Ry/Rz gates, channels, or any segment after a
+    t gate) are drawn live.
+
+    Frames of a stored clip are not drawn at all.  `save` concatenates the
+    clips and the live frames (encoded into temporary parts) into the output
+    file.  `ext` is 'gif' (encoded with the fixed palette `colors`) or 'mp4'.
+    Clips of another render version of `draw_func` are deleted.
+    '''
+    def __init__(self, library_dir, draw_func=None, callback=None, ext='gif',
+                 fps=20, colors=('#fff', '#000')):
+        super().__init__(draw_func, callback)
+        self.library_dir = library_dir
+        self.ext = ext
+        self.fps = fps
+        self.colors = colors
+        self.version = render_version(draw_func)
+        os.makedirs(library_dir, exist_ok=True)
+        pruned = prune_versions(library_dir, self.version, f'.{ext}')
+        if pruned:
+            print(f'Deleted {pruned} stale clips from "{library_dir}"',
+                  file=sys.stderr)
+        self.frame_count = 0
+        self.cached_count = 0
+        self.paths = []  # Clips and parts of live frames in order
+        self._live = []
+        self._live_start = 0
+        self._tmp_dir = None
+        self._depth = 0
+        self._key = None
+        self._hit = False
+        self._new = None
+
+    @property
+    def frames(self):
+        return range(self.frame_count)
+    @frames.setter
+    def frames(self, value):
+        # Set by FrameAnimation.__init__
+        pass
+
+    def _clip_path(self, key):
+        return os.path.join(self.library_dir,
+                            f'{key}.v{self.version}.{self.ext}')
+
+    def _encode(self, frames, path, start_frame=0):
+        if self.ext == 'gif':
+            gif.save_gif(frames, path, fps=self.fps, colors=self.colors,
+                         start_frame=start_frame)
+        else:
+            draw.video.save_video(frames, path, fps=self.fps)
+
+    def _flush_live(self):
+        '''Encodes the live frames drawn since the last clip as a part.'''
+        if not self._live:
+            return
+        if self._tmp_dir is None:
+            self._tmp_dir = tempfile.mkdtemp(prefix='bloch_clips_')
+        start = self._live_start
+        path = shards.part_path(os.path.join(self._tmp_dir, 'live'), start,
+                                start + len(self._live), self.ext)
+        self._encode(self._live, path, start_frame=start)
+        self.paths.append(path)
+        self._live = []
+
+    def key_for(self, fps, speed, inner_proj, inner_opacity, extra_opacity,
+                label, axis, draw_args, kind=None, *params):
+        '''Returns the library key of a segment or None to draw it live.'''
+        index = clifford_index(inner_proj)
+        if index is None:
+            return None
+        if kind == 'gate':
+            # Custom and Rx/Ry/Rz gates have no name
+            if params[-1] is None:
+                return None
+        elif kind not in CLIP_SEGMENTS:
+            return None
+        if extra_opacity == 0:
+            # The label and axis of the previous gate are not visible
+            label = axis = None
+        return segment_key(getattr(self.draw_func, '__qualname__', None),
+                           self.version, fps, speed, ('clifford', index),
+                           inner_opacity, extra_opacity, label, axis,
+                           draw_args, kind, *params)
+
+    def begin_segment(self, *key_values):
+        '''Starts a segment.  Nested segments are part of the outer one.'''
+        self._depth += 1
+        if self._depth > 1:
+            return
+        self._key = self.key_for(*key_values)
+        if self._key is None:
+            return
+        self._flush_live()
+        self._hit = os.path.exists(self._clip_path(self._key))
+        self._new = None if self._hit else []
+
+    def end_segment(self):
+        self._depth -= 1
+        if self._depth > 0:
+            return
+        if self._key is not None:
+            path = self._clip_path(self._key)
+            if self._new:
+                # Keep the extension for the video encoder
+                partial_path = f'{path}.partial.{self.ext}'
+                self._encode(self._new, partial_path)
+                os.replace(partial_path, path)
+            if self._hit or self._new:
+                self.paths.append(path)
+        self._key = self._new = None
+        self._hit = False
+
+    def abort_segment(self):
+        '''Ends a segment without storing it.  Frames it drew are kept as
+        live frames.'''
+        self._depth -= 1
+        if self._depth == 0:
+            if self._new:
+                self._live_start = self.frame_count - len(self._new)
+                self._live.extend(self._new)
+            self._key = self._new = None
+            self._hit = False
+
+    def draw_frame(self, *args, **kwargs):
+        self.frame_count += 1
+        if self._hit:
+            self.cached_count += 1
+            return None
+        frame = self.draw_func(*args, **kwargs)
+        arr = rasterize_frame(frame)
+        if self._new is not None:
+            self._new.append(arr)
+        else:
+            if not self._live:
+                self._live_start = self.frame_count - 1
+            self._live.append(arr)
+        self.callback(frame)
+        return frame
+
+    def save(self, file):
+        '''Concatenates the clips and live frames into `file` without
+        re-encoding the clips.'''
+        self._flush_live()
+        try:
+            if not self.paths:
+                raise ValueError('No frames to save.')
+            if self.ext == 'gif':
+                shards.merge_gifs(self.paths, file)
+            else:
+                shards.merge_videos(self.paths, file)
+        finally:
+            self.close()
+
+    def close(self):
+        '''Deletes the encoded live frames.'''
+        if self._tmp_dir is not None:
+            shutil.rmtree(self._tmp_dir, ignore_errors=True)
+        self._tmp_dir = None
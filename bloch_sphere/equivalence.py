@@ -0,0 +1,221 @@
+'''Checks that alternate rendering backends draw the same Bloch sphere as the
+reference `draw_frame`.
+
+Frames from a fixed corpus of gate lists (both styles, with labels and a
+rotation arrow) are drawn by the reference and by each candidate, compared
+by perceptual pixel difference and by a structural diff of the SVG, and
+timed at several output sizes (small sizes use the level of detail).  SVG
+differences are reported but only fail the check when pixels
+are not compared (--no-pixels).  Run with:
+
+    python3 -m bloch_sphere.equivalence [--candidate module:function ...]
+
+A candidate takes the same arguments as `draw_frame` and returns a
+`drawsvg.Drawing` or an RGB array.
+'''
+
+import argparse
+import difflib
+import functools
+import importlib
+import itertools
+import re
+import sys
+import time
+
+import numpy as np
+
+import drawsvg as draw
+from hyperbolic import euclid3d
+
+from bloch_sphere import animate_bloch
+from bloch_sphere.frame_store import rasterize_frame
+
+
+CORPUS = (
+    ('x', 'y', 's', 's'),
+    ('h', 'h'),
+    ('ry;0.666667', 'ry;0.666667', 'ry;0.666667'),
+    ('sqrt_x', 'inv_sqrt_y', 't'),
+    ('custom;0;1;1;1;Hzy', 'inv_h'),
+)
+STYLES = ('sphere', 'arrows')
+# Output widths in pixels below and above animate_bloch.LOD_PX_PER_UNIT
+WIDTHS = (96, 1248)
+
+REFERENCE = functools.partial(animate_bloch.draw_frame, lod=False)
+BACKENDS = {
+    'lod': animate_bloch.draw_frame,
+}
+
+# Perceptual difference thresholds (CIE76 delta E after a 3x3 blur).  A peak
+# of 10 allows the sub-pixel shifts of arcs drawn as polylines and of skipped
+# labels smaller than LOD_MIN_TEXT_PX (the level of detail peaks at 8.2 at
+# 96 px) but not a missing arrowhead (13.1).
+MAX_MEAN_DELTA_E = 0.5
+MAX_PEAK_DELTA_E = 10
+
+
+def corpus_draw_args(w):
+    zero_ket = draw.Text(['|0⟩'], 0.15, 0, 0, center=True)
+    one_ket = draw.Text(['|1⟩'], 0.15, 0, 0, center=True)
+    return dict(
+        w=w,
+        rot_proj=euclid3d.rotation3d((0, 0, 1), 0.3),
+        outer_labels=[
+            [(0, 0, 1), (-0.15, 0.13), zero_ket],
+            [(0, 0, -1), (0.15, -0.13), one_ket],
+        ],
+        inner_labels=[
+            [(0, 0, 0.8), (0, 0), zero_ket],
+            [(0, 0, -0.8), (0, 0), one_ket],
+        ],
+    )
+
+def record_frames(gates, style, w=624, fps=20, stride=5):
+    '''Returns the arguments of every `stride`-th `draw_frame` call made when
+    animating `gates`.'''
+    anim = draw.FrameAnimation(lambda *args, **kwargs: (args, kwargs))
+    state = animate_bloch.AnimState(anim, fps=fps, draw_args=dict(
+        corpus_draw_args(w), style=style))
+    state.apply_gate_list(gates)
+    return anim.frames[::stride]
+
+def svg_structure(svg):
+    '''SVG lines with ids normalized and numbers rounded so only meaningful
+    differences remain.'''
+    svg = re.sub(r'(id|href)="[^"]*"', r'\1=""', svg)
+    svg = re.sub(r'-?\d+\.\d+(e-?\d+)?',
+                 lambda m: f'{float(m.group()):.3f}', svg)
+    return svg.splitlines()
+
+def srgb_to_lab(arr):
+    c = arr[..., :3].astype(float) / 255
+    c = np.where(c <= 0.04045, c/12.92, ((c+0.055)/1.055)**2.4)
+    xyz = c @ np.array([[0.4124, 0.3576, 0.1805],
+                        [0.2126, 0.7152, 0.0722],
+                        [0.0193, 0.1192, 0.9505]]).T
+    xyz /= np.array([0.9505, 1, 1.089])
+    f = np.where(xyz > (6/29)**3, np.cbrt(xyz), xyz/(3*(6/29)**2) + 4/29)
+    return np.stack([116*f[..., 1] - 16, 500*(f[..., 0] - f[..., 1]),
+                     200*(f[..., 1] - f[..., 2])], axis=-1)
+
+def _blur(arr):
+    p = np.pad(arr, ((1, 1), (1, 1), (0, 0)), mode='edge')
+    h, w = arr.shape[:2]
+    return sum(p[i:i+h, j:j+w] for i in range(3) for j in range(3)) / 9
+
+def perceptual_difference(arr1, arr2):
+    '''Returns (mean, peak) CIE76 delta E between two RGB images after a
+    small blur so anti-aliasing differences are not counted.'''
+    if arr1.shape[:2] != arr2.shape[:2]:
+        return np.inf, np.inf
+    delta = np.linalg.norm(_blur(srgb_to_lab(arr1))
+                           - _blur(srgb_to_lab(arr2)), axis=-1)
+    return delta.mean(), delta.max()
+
+def _render(draw_func, args, kwargs, pixels):
+    t = time.perf_counter()
+    out = draw_func(*args, **kwargs)
+    svg = None
+    if isinstance(out, np.ndarray):
+        arr = out
+    else:
+        svg = out.as_svg()
+        arr = rasterize_frame(out) if pixels else None
+    return svg, arr, time.perf_counter() - t
+
+def compare_backends(candidates, corpus=CORPUS, styles=STYLES, widths=WIDTHS,
+                     stride=5, pixels=True, reference=REFERENCE):
+    '''Compares each candidate draw function to `reference` on every corpus
+    frame at each output width.  Returns a list of result dicts, one per
+    candidate, and a list of mismatch descriptions.'''
+    results = {name: dict(name=name, frames=0, svg_diffs=0, pixel_diffs=0,
+                          mean_delta_e=0, peak_delta_e=0, time=0,
+                          ref_time=0)
+               for name in candidates}
+    mismatches = []
+    for w, gates, style in itertools.product(widths, corpus, styles):
+        for i, (args, kwargs) in enumerate(
+                record_frames(gates, style, w=w, stride=stride)):
+            where = f'{",".join(gates)} {style} {w:g}px frame {i*stride}'
+            ref_svg, ref_arr, ref_time = _render(
+                reference, args, kwargs, pixels)
+            for name, func in candidates.items():
+                r = results[name]
+                svg, arr, cand_time = _render(func, args, kwargs, pixels)
+                r['frames'] += 1
+                r['time'] += cand_time
+                r['ref_time'] += ref_time
+                if svg is not None:
+                    diff = list(difflib.unified_diff(
+                        svg_structure(ref_svg), svg_structure(svg),
+                        lineterm='', n=0))
+                    if diff:
+                        r['svg_diffs'] += 1
+                        mismatches.append(
+                            f'{name}: {where}: SVG differs '
+                            f'({len(diff)-2} diff lines)')
+                if pixels:
+                    mean, peak = perceptual_difference(ref_arr, arr)
+                    r['mean_delta_e'] = max(r['mean_delta_e'], mean)
+                    r['peak_delta_e'] = max(r['peak_delta_e'], peak)
+                    if mean > MAX_MEAN_DELTA_E or peak > MAX_PEAK_DELTA_E:
+                        r['pixel_diffs'] += 1
+                        mismatches.append(
+                            f'{name}: {where}: pixels differ (mean '
+                            f'ΔE {mean:.2f}, peak ΔE {peak:.1f})')
+    return list(results.values()), mismatches
+
+def print_report(results, mismatches, pixels=True, file=None):
+    for line in mismatches:
+        print(line, file=file)
+    print(f'{"backend":<20}{"frames":>8}{"svg diff":>10}'
+          + (f'{"px diff":>9}{"max mean ΔE":>13}{"max peak ΔE":>13}'
+             if pixels else '')
+          + f'{"time (s)":>10}{"ref (s)":>10}{"speedup":>9}', file=file)
+    for r in results:
+        print(f'{r["name"]:<20}{r["frames"]:>8}{r["svg_diffs"]:>10}'
+              + (f'{r["pixel_diffs"]:>9}{r["mean_delta_e"]:>13.2f}'
+                 f'{r["peak_delta_e"]:>13.1f}' if pixels else '')
+              + f'{r["time"]:>10.2f}{r["ref_time"]:>10.2f}'
+              f'{r["ref_time"]/max(r["time"], 1e-9):>8.2f}x', file=file)
+
+def load_candidate(spec):
+    '''Imports a draw function given as "module:function".'''
+    module_name, _, func_name = spec.partition(':')
+    return getattr(importlib.import_module(module_name), func_name)
+
+def run_from_command_line():
+    parser = argparse.ArgumentParser(
+        description='Compares alternate Bloch sphere rendering backends to the '
+                    'reference draw_frame on a fixed corpus of gate lists.')
+    parser.add_argument('--candidate', type=str, action='append', help=
+        'Draw function to compare as module:function (default: the built-in '
+        'backends: {})'.format(', '.join(BACKENDS)))
+    parser.add_argument('--width', type=float, action='append', help=
+        'Output width of each frame in pixels (may be repeated, default: {})'
+        .format(', '.join(map(str, WIDTHS))))
+    parser.add_argument('--stride', type=int, default=5, help=
+        'Compare every Nth frame of each animation')
+    parser.add_argument('--no-pixels', action='store_true', help=
+        'Only compare the SVG (no rasterization).  SVG differences are then '
+        'errors instead of warnings.')
+    args = parser.parse_args()
+    if args.candidate:
+        candidates = {spec: load_candidate(spec) for spec in args.candidate}
+    else:
+        candidates = dict(BACKENDS)
+    pixels = not args.no_pixels
+    results, mismatches = compare_backends(
+        candidates, widths=args.width or WIDTHS, stride=args.stride,
+        pixels=pixels)
+    print_report(results, mismatches, pixels=pixels)
+    # Backends like the level of detail may draw different SVG that looks
+    # the same so the SVG diff only fails the check without the pixel diff
+    if any(r['pixel_diffs'] or (not pixels and r['svg_diffs'])
+           for r in results):
+        sys.exit(1)
+
+if __name__ == '__main__':
+    run_from_command_line()
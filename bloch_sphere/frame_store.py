@@ -0,0 +1,172 @@
+import json
+import os
+
+import numpy as np
+
+import drawsvg as draw  # pip install drawsvg
+
+
+def rasterize_frame(frame, alpha=False):
+    '''Returns the pixels of a drawing as an RGB (or RGBA if `alpha`) uint8
+    array of shape (height, width, 3 or 4).'''
+    arr = draw.video.render_svg_frames([frame])[0]
+    if arr.ndim == 2:
+        arr = np.repeat(arr[..., None], 3, axis=-1)
+    if not alpha:
+        arr = arr[..., :3]
+    elif arr.shape[-1] == 3:
+        arr = np.concatenate(
+            [arr, np.full(arr.shape[:2]+(1,), 255, dtype=arr.dtype)], axis=-1)
+    return np.ascontiguousarray(arr, dtype=np.uint8)
+
+def _to_ranges(indices):
+    ranges = []
+    for i in sorted(indices):
+        if ranges and ranges[-1][1] == i:
+            ranges[-1][1] = i + 1
+        else:
+            ranges.append([i, i + 1])
+    return ranges
+
+
+class FrameStore:
+    '''Raw RGB frames kept in a memory-mapped file on disk.
+
+    Completed frame indices are recorded in a JSON manifest next to the raw
+    file (`{path}.json`) only after the frame pixels are flushed so an
+    interrupted render can be resumed by skipping the frames already in the
+    store.  The manifest also records a digest of `meta` (e.g. the render
+    settings, which may contain arrays or drawing elements) and a store
+    written with different `meta` or a different frame size is discarded
+    instead of reused.
+    '''
+    def __init__(self, path, meta=None):
+        # Imported here since segment_cache builds on FrameStore
+        from bloch_sphere.segment_cache import segment_key
+        self.path = path
+        self.manifest_path = f'{path}.json'
+        self.meta = meta
+        self.meta_key = segment_key(meta)
+        self.shape = None
+        self.done = set()
+        self._written = False
+        self._load()
+
+    def _load(self):
+        try:
+            with open(self.manifest_path, 'r') as f:
+                manifest = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return
+        if (manifest.get('meta') != self.meta_key
+                or not os.path.exists(self.path)):
+            return
+        self.shape = tuple(manifest['shape'])
+        for start, stop in manifest['done']:
+            self.done.update(range(start, stop))
+
+    def _save_manifest(self):
+        manifest = dict(meta=self.meta_key, shape=self.shape,
+                        done=_to_ranges(self.done))
+        tmp_path = f'{self.manifest_path}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(manifest, f)
+        os.replace(tmp_path, self.manifest_path)
+
+    @property
+    def frame_bytes(self):
+        return int(np.prod(self.shape))
+
+    def __contains__(self, i):
+        return i in self.done
+
+    def __len__(self):
+        return max(self.done) + 1 if self.done else 0
+
+    def write(self, i, arr):
+        '''Stores the RGB pixels of frame `i`.'''
+        arr = np.asarray(arr, dtype=np.uint8)
+        if self.shape is not None and arr.shape != self.shape and (
+                not self._written):
+            # Frames left by an earlier render at another size
+            self.shape = None
+            self.done = set()
+        if self.shape is None:
+            self.shape = arr.shape
+            # Drop any stale data left by a store with other settings
+            open(self.path, 'wb').close()
+        elif arr.shape != self.shape:
+            raise ValueError(f'Frame {i} has shape {arr.shape} but the frame '
+                             f'store has shape {self.shape}.')
+        size = (i+1) * self.frame_bytes
+        with open(self.path, 'r+b') as f:
+            if os.fstat(f.fileno()).st_size < size:
+                f.truncate(size)
+        mm = np.memmap(self.path, dtype=np.uint8, mode='r+',
+                       offset=i*self.frame_bytes, shape=self.shape)
+        mm[:] = arr
+        mm.flush()
+        del mm
+        self._written = True
+        self.done.add(i)
+        self._save_manifest()
+
+    def frames(self, start=0, stop=None):
+        '''Returns a list of read-only views of the stored frames.  No pixel
+        data is copied or read until the views are used.'''
+        if stop is None:
+            stop = len(self)
+        missing = [i for i in range(start, stop) if i not in self.done]
+        if missing:
+            raise ValueError(f'Frame store "{self.path}" is missing '
+                             f'{len(missing)} frames (first: {missing[0]}).')
+        if stop <= start:
+            return []
+        mm = np.memmap(self.path, dtype=np.uint8, mode='r',
+                       offset=start*self.frame_bytes,
+                       shape=(stop-start, *self.shape))
+        return list(mm)
+
+    def move(self, path):
+        '''Renames the store files (e.g. once the store is complete).'''
+        manifest_path = f'{path}.json'
+        os.replace(self.path, path)
+        os.replace(self.manifest_path, manifest_path)
+        self.path = path
+        self.manifest_path = manifest_path
+
+    def remove(self):
+        for path in (self.path, self.manifest_path):
+            if os.path.exists(path):
+                os.remove(path)
+
+
+class StoredFrameAnimation(draw.FrameAnimation):
+    '''A `FrameAnimation` that rasterizes each frame into a `FrameStore`
+    instead of keeping the drawings in memory.  Frames already in the store
+    are not drawn again.'''
+    def __init__(self, store, draw_func=None, callback=None):
+        super().__init__(draw_func, callback)
+        self.store = store
+        self.frame_count = 0
+
+    @property
+    def frames(self):
+        return range(self.frame_count)
+    @frames.setter
+    def frames(self, value):
+        # Set by FrameAnimation.__init__
+        pass
+
+    def should_draw(self, i):
+        return i not in self.store
+
+    def draw_frame(self, *args, **kwargs):
+        i = self.frame_count
+        self.frame_count += 1
+        if not self.should_draw(i):
+            return None
+        frame = self.draw_func(*args, **kwargs)
+        self.store.write(i, rasterize_frame(frame))
+        self.callback(frame)
+        return frame
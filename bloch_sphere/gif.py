@@ -0,0 +1,144 @@
+import io
+import struct
+import time
+
+import numpy as np
+
+
+TRANSPARENT = 255  # Palette index reserved for unchanged pixels
+_LUT_BITS = 5
+
+def parse_color(color):
+    '''Converts '#rgb' or '#rrggbb' to an RGB triple.'''
+    h = color.lstrip('#')
+    if len(h) == 3:
+        h = ''.join(c*2 for c in h)
+    return tuple(int(h[i:i+2], 16) for i in (0, 2, 4))
+
+def build_palette(colors, white_steps=12, black_steps=6):
+    '''Returns a palette (N x 3 uint8 array, N < 256) with the given scene
+    colors, the anti-aliasing ramps from each color to white and black, and
+    the midpoints between each pair of colors.'''
+    base = list(dict.fromkeys(parse_color(c) for c in colors))
+    white = np.array((255, 255, 255))
+    black = np.array((0, 0, 0))
+    palette = [np.array(c) for c in base]
+    for c in palette[:len(base)]:
+        for t in np.linspace(0, 1, white_steps+1, endpoint=False)[1:]:
+            palette.append(c*(1-t) + white*t)
+        for t in np.linspace(0, 1, black_steps+1, endpoint=False)[1:]:
+            palette.append(c*(1-t) + black*t)
+    for i, c1 in enumerate(base):
+        for c2 in base[i+1:]:
+            palette.append((np.array(c1) + np.array(c2)) / 2)
+    palette = np.unique(np.round(palette).astype(np.uint8), axis=0)
+    if len(palette) >= TRANSPARENT:
+        raise ValueError(f'Too many palette colors ({len(palette)}).  Use '
+                         f'fewer colors or ramp steps.')
+    return palette
+
+def _palette_lut(palette):
+    '''Nearest palette index for every color quantized to `_LUT_BITS` bits
+    per channel.'''
+    n = 1 << _LUT_BITS
+    centers = (np.arange(n) << (8-_LUT_BITS)) + (1 << (7-_LUT_BITS))
+    grid = np.stack(np.meshgrid(centers, centers, centers, indexing='ij'),
+                    axis=-1).reshape(-1, 1, 3).astype(np.int32)
+    pal = palette.astype(np.int32)[None]
+    lut = np.empty(len(grid), dtype=np.uint8)
+    chunk = 4096
+    for i in range(0, len(grid), chunk):
+        dist = ((grid[i:i+chunk] - pal)**2).sum(axis=-1)
+        lut[i:i+chunk] = dist.argmin(axis=-1)
+    return lut.reshape(n, n, n)
+
+def _write_frame(out, indices, offset, transparency, duration_cs):
+    from PIL import Image, GifImagePlugin
+    im = Image.fromarray(indices, 'P')
+    params = dict(duration=duration_cs*10, disposal=1)
+    if transparency:
+        params['transparency'] = TRANSPARENT
+    for data in GifImagePlugin.getdata(im, offset=offset, **params):
+        out.write(data)
+
+def save_gif(frames, file, fps=20, colors=('#fff', '#000'), loop=0,
+             start_frame=0):
+    '''Encodes RGB frames as a GIF with one fixed global palette.
+
+    Each frame after the first only stores the rectangle that changed since
+    the previous frame with unchanged pixels inside it left transparent.
+    Runs of identical frames are merged into one longer frame.  `frames` may
+    be any iterable of (height, width, 3) uint8 arrays so frames can be
+    rasterized while encoding.  `start_frame` is the index of the first frame
+    in the whole animation, used to time frames consistently when one
+    animation is encoded in parts.
+
+    Returns (size in bytes, encode time in seconds).  The encode time does not
+    include time spent producing the frames.
+    '''
+    start_time = time.perf_counter()
+    frame_time = 0
+    def timed(frames):
+        nonlocal frame_time
+        it = iter(frames)
+        while True:
+            t = time.perf_counter()
+            try:
+                arr = next(it)
+            except StopIteration:
+                return
+            finally:
+                frame_time += time.perf_counter() - t
+            yield arr
+
+    palette = build_palette(colors)
+    lut = _palette_lut(palette)
+    shift = 8 - _LUT_BITS
+
+    out = io.BytesIO()
+    prev = None
+    pending = None  # (indices, offset, transparency, duration)
+    for i, arr in enumerate(timed(frames)):
+        arr = np.asarray(arr)
+        idx = lut[arr[..., 0] >> shift, arr[..., 1] >> shift,
+                  arr[..., 2] >> shift]
+        # Centiseconds without accumulating rounding error
+        j = start_frame + i
+        duration = round((j+1)*100/fps) - round(j*100/fps)
+        if prev is None:
+            h, w = idx.shape
+            pal_bytes = np.zeros((256, 3), dtype=np.uint8)
+            pal_bytes[:len(palette)] = palette
+            out.write(b'GIF89a' + struct.pack('<HHBBB', w, h, 0xf7, 0, 0))
+            out.write(pal_bytes.tobytes())
+            if loop is not None:
+                out.write(b'!\xff\x0bNETSCAPE2.0\x03\x01'
+                          + struct.pack('<H', loop) + b'\x00')
+            pending = [idx, (0, 0), False, duration]
+            prev = idx
+            continue
+        changed = idx != prev
+        rows = np.flatnonzero(changed.any(axis=1))
+        if len(rows) == 0:
+            pending[3] += duration
+            continue
+        cols = np.flatnonzero(changed.any(axis=0))
+        y0, y1 = rows[0], rows[-1]+1
+        x0, x1 = cols[0], cols[-1]+1
+        delta = idx[y0:y1, x0:x1].copy()
+        delta[~changed[y0:y1, x0:x1]] = TRANSPARENT
+        _write_frame(out, *pending)
+        pending = [delta, (int(x0), int(y0)), True, duration]
+        prev = idx
+    if pending is None:
+        raise ValueError('No frames to save.')
+    _write_frame(out, *pending)
+    out.write(b';')
+
+    data = out.getvalue()
+    if isinstance(file, str):
+        with open(file, 'wb') as f:
+            f.write(data)
+    else:
+        file.write(data)
+    return len(data), time.perf_counter() - start_time - frame_time
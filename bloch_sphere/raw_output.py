@@ -0,0 +1,66 @@
+import json
+import sys
+
+import drawsvg as draw
+
+from bloch_sphere.frame_store import rasterize_frame
+
+
+class RawFrameAnimation(draw.FrameAnimation):
+    '''A `FrameAnimation` that writes the raw pixels of each frame (rows of
+    RGB or RGBA bytes) to a file or named pipe as soon as it is drawn.
+
+    `path` may be '-' for stdout.  Writes block while the reader is behind so
+    no more than one frame is buffered.  The frame size, frame rate, and
+    pixel format are written as JSON to `{path}.json` (or stderr for stdout)
+    after the first frame is rendered and before `path` is opened, so a
+    reader of a named pipe can read it first.  E.g. pipe stdout into:
+
+        ffmpeg -f rawvideo -pix_fmt rgb24 -s {width}x{height} -r {fps} -i -
+    '''
+    def __init__(self, path, draw_func=None, fps=20, alpha=False,
+                 callback=None):
+        super().__init__(draw_func, callback)
+        self.path = path
+        self.fps = fps
+        self.alpha = alpha
+        self.out = None
+        self.frame_count = 0
+
+    @property
+    def frames(self):
+        return range(self.frame_count)
+    @frames.setter
+    def frames(self, value):
+        # Set by FrameAnimation.__init__
+        pass
+
+    def _open(self, arr):
+        info = dict(width=arr.shape[1], height=arr.shape[0], fps=self.fps,
+                    pix_fmt='rgba' if arr.shape[-1] == 4 else 'rgb24')
+        if self.path == '-':
+            print(json.dumps(info), file=sys.stderr, flush=True)
+            self.out = sys.stdout.buffer
+        else:
+            with open(f'{self.path}.json', 'w') as f:
+                json.dump(info, f)
+            # Waits for a reader if path is a named pipe
+            self.out = open(self.path, 'wb')
+
+    def write_frame(self, arr):
+        if self.out is None:
+            self._open(arr)
+        self.out.write(memoryview(arr).cast('B'))
+        self.out.flush()
+        self.frame_count += 1
+
+    def draw_frame(self, *args, **kwargs):
+        frame = self.draw_func(*args, **kwargs)
+        self.write_frame(rasterize_frame(frame, alpha=self.alpha))
+        self.callback(frame)
+        return frame
+
+    def close(self):
+        if self.out is not None and self.out is not sys.stdout.buffer:
+            self.out.close()
+        self.out = None
@@ -0,0 +1,156 @@
+import hashlib
+import inspect
+import json
+import os
+import re
+import sys
+
+import numpy as np
+
+import drawsvg as draw
+
+from bloch_sphere.frame_store import FrameStore, rasterize_frame
+
+
+def fingerprint(value):
+    '''Converts animation state and parameters into a JSON-able value that
+    only depends on what is drawn.'''
+    if isinstance(value, dict):
+        return {str(k): fingerprint(v) for k, v in sorted(value.items())}
+    if isinstance(value, (list, tuple)):
+        return [fingerprint(v) for v in value]
+    if isinstance(value, np.ndarray):
+        if value.size > 64:
+            # E.g. a point cloud
+            digest = hashlib.sha1(np.ascontiguousarray(value).data).hexdigest()
+            return ['ndarray', list(value.shape), str(value.dtype), digest]
+        return fingerprint(value.tolist())
+    if isinstance(value, (np.floating, np.integer)):
+        return value.item()
+    if isinstance(value, draw.DrawingElement):
+        # SVG output is deterministic for a fixed id prefix
+        d = draw.Drawing(1, 1, id_prefix='key')
+        d.append(value)
+        return d.as_svg()
+    if hasattr(value, 'matrix'):  # euclid3d.Projection
+        return [type(value).__name__, fingerprint(value.matrix),
+                fingerprint(getattr(value, 'offset', None))]
+    if value is None or isinstance(value, (str, int, float, bool)):
+        return value
+    return repr(value)
+
+def render_version(func):
+    '''The `RENDER_VERSION` of the module defining `func`, which is bumped
+    whenever the drawing output changes so cached frames are not reused.'''
+    return getattr(inspect.getmodule(func), 'RENDER_VERSION', None)
+
+def prune_versions(directory, version, ext):
+    '''Deletes the entries `{key}.v{version}{ext}` (and their manifests and
+    partial writes) in `directory` of any other render version and returns
+    the number of entries deleted.'''
+    pattern = re.compile(r'([0-9a-f]{40})(?:\.v([^.]*))?' + re.escape(ext))
+    stale = set()
+    for name in os.listdir(directory):
+        m = pattern.match(name)
+        if m and m.group(2) != str(version):
+            stale.add(m.group(1, 2))
+            os.remove(os.path.join(directory, name))
+    return len(stale)
+
+def segment_key(*values):
+    data = json.dumps(fingerprint(values), sort_keys=True)
+    return hashlib.sha1(data.encode()).hexdigest()
+
+
+class SegmentCacheAnimation(draw.FrameAnimation):
+    '''A `FrameAnimation` that stores the rasterized frames of each animation
+    segment (e.g. one gate) on disk in `cache_dir` keyed by the animation
+    state before the segment and the segment parameters.
+
+    When a segment with the same key was rendered before, its frames are
+    spliced in from the cache instead of being drawn.  The rasterized output
+    frames are collected in `raster_frames`.  Segments cached by another
+    render version of `draw_func` are deleted.
+    '''
+    def __init__(self, cache_dir, draw_func=None, callback=None):
+        super().__init__(draw_func, callback)
+        self.cache_dir = cache_dir
+        self.version = render_version(draw_func)
+        os.makedirs(cache_dir, exist_ok=True)
+        pruned = prune_versions(cache_dir, self.version, '.frames')
+        if pruned:
+            print(f'Deleted {pruned} stale segments from "{cache_dir}"',
+                  file=sys.stderr)
+        self.raster_frames = []
+        self.cached_count = 0
+        self._depth = 0
+        self._key = None
+        self._cached = None
+        self._new = None
+
+    @property
+    def frames(self):
+        return range(len(self.raster_frames))
+    @frames.setter
+    def frames(self, value):
+        # Set by FrameAnimation.__init__
+        pass
+
+    def _segment_path(self, key):
+        return os.path.join(self.cache_dir, f'{key}.v{self.version}.frames')
+
+    def key_for(self, *key_values):
+        '''Returns the cache key of a segment or None to draw it without
+        caching.'''
+        return segment_key(getattr(self.draw_func, '__qualname__', None),
+                           self.version, *key_values)
+
+    def begin_segment(self, *key_values):
+        '''Starts a segment.  Nested segments are part of the outer one.'''
+        self._depth += 1
+        if self._depth > 1:
+            return
+        self._key = self.key_for(*key_values)
+        if self._key is None:
+            self._cached = self._new = None
+            return
+        store = FrameStore(self._segment_path(self._key), meta=self._key)
+        if len(store):
+            self._cached = store.frames()
+            self._cached.reverse()
+            self._new = None
+        else:
+            self._cached = None
+            self._new = []
+
+    def end_segment(self):
+        self._depth -= 1
+        if self._depth > 0:
+            return
+        if self._new:
+            path = self._segment_path(self._key)
+            FrameStore(f'{path}.partial').remove()
+            store = FrameStore(f'{path}.partial', meta=self._key)
+            for i, arr in enumerate(self._new):
+                store.write(i, arr)
+            store.move(path)
+        self._key = self._cached = self._new = None
+
+    def abort_segment(self):
+        '''Ends a segment without caching its frames.'''
+        self._depth -= 1
+        if self._depth == 0:
+            self._key = self._cached = self._new = None
+
+    def draw_frame(self, *args, **kwargs):
+        if self._cached:
+            self.raster_frames.append(self._cached.pop())
+            self.cached_count += 1
+            return None
+        frame = self.draw_func(*args, **kwargs)
+        arr = rasterize_frame(frame)
+        self.raster_frames.append(arr)
+        if self._new is not None:
+            self._new.append(arr)
+        self.callback(frame)
+        return frame
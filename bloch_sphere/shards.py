@@ -0,0 +1,194 @@
+'''Rendering one animation in contiguous frame ranges (e.g. on several
+machines sharing a file system) and merging the parts.
+
+Each part is saved as `{name}.part-{start:06d}-{stop:06d}.{ext}`.  GIF parts
+are encoded with the fixed scene palette so merging only concatenates their
+frame data.  MP4 parts are concatenated by ffmpeg without re-encoding.
+'''
+
+import glob
+import os
+import re
+import subprocess
+import tempfile
+
+import drawsvg as draw
+
+from bloch_sphere import gif
+from bloch_sphere.frame_store import rasterize_frame
+
+
+def count_frames(func, state_factory):
+    '''Returns the number of frames `func(state)` draws without drawing
+    them.'''
+    anim = draw.FrameAnimation(lambda *args, **kwargs: None)
+    func(state_factory(anim))
+    return len(anim.frames)
+
+def frame_range(total, shard=None, frames=None):
+    '''Returns (start, stop) given a shard 'K/N' (K counts from 0) or a frame
+    range 'A:B' (either side may be empty).'''
+    if shard is not None:
+        m = re.fullmatch(r'(\d+)/(\d+)', shard)
+        if not m or not int(m.group(1)) < int(m.group(2)):
+            raise ValueError(f'Invalid shard "{shard}".  Use K/N with '
+                             f'0 <= K < N.')
+        k, n = int(m.group(1)), int(m.group(2))
+        return k*total//n, (k+1)*total//n
+    m = re.fullmatch(r'(\d*):(\d*)', frames)
+    if not m:
+        raise ValueError(f'Invalid frame range "{frames}".  Use A:B.')
+    start = int(m.group(1) or 0)
+    stop = min(int(m.group(2) or total), total)
+    return min(start, stop), stop
+
+def part_path(name, start, stop, ext):
+    return f'{name}.part-{start:06d}-{stop:06d}.{ext}'
+
+
+class RangeFrameAnimation(draw.FrameAnimation):
+    '''A `FrameAnimation` that only draws and rasterizes the frames in
+    [start, stop) and collects them in `raster_frames`.'''
+    def __init__(self, start, stop, draw_func=None, callback=None):
+        super().__init__(draw_func, callback)
+        self.start = start
+        self.stop = stop
+        self.frame_count = 0
+        self.raster_frames = []
+
+    @property
+    def frames(self):
+        return range(self.frame_count)
+    @frames.setter
+    def frames(self, value):
+        # Set by FrameAnimation.__init__
+        pass
+
+    def draw_frame(self, *args, **kwargs):
+        i = self.frame_count
+        self.frame_count += 1
+        if not self.start <= i < self.stop:
+            return None
+        frame = self.draw_func(*args, **kwargs)
+        self.raster_frames.append(rasterize_frame(frame))
+        self.callback(frame)
+        return frame
+
+
+class SparseFrameAnimation(draw.FrameAnimation):
+    '''A `FrameAnimation` that counts every frame but only draws the frames
+    with the given `indices` and keeps them in the dict `drawn`.'''
+    def __init__(self, indices, draw_func=None, callback=None):
+        super().__init__(draw_func, callback)
+        self.indices = set(indices)
+        self.frame_count = 0
+        self.drawn = {}
+
+    @property
+    def frames(self):
+        return range(self.frame_count)
+    @frames.setter
+    def frames(self, value):
+        # Set by FrameAnimation.__init__
+        pass
+
+    def draw_frame(self, *args, **kwargs):
+        i = self.frame_count
+        self.frame_count += 1
+        if i not in self.indices:
+            return None
+        frame = self.draw_func(*args, **kwargs)
+        self.drawn[i] = frame
+        self.callback(frame)
+        return frame
+
+
+def save_part(frames, name, start, stop, ext, fps, colors):
+    '''Encodes the frames [start, stop) of an animation as one part.'''
+    path = part_path(name, start, stop, ext)
+    if ext == 'gif':
+        gif.save_gif(frames, path, fps=fps, colors=colors, start_frame=start)
+    else:
+        draw.video.save_video(frames, path, fps=fps)
+    return path
+
+def find_parts(name, ext, total):
+    '''Returns the part files covering frames [0, total) in order.'''
+    pattern = re.compile(re.escape(os.path.basename(name))
+                         + rf'\.part-(\d+)-(\d+)\.{ext}')
+    parts = {}
+    for path in sorted(glob.glob(glob.escape(name) + f'.part-*.{ext}')):
+        m = pattern.fullmatch(os.path.basename(path))
+        if m and int(m.group(1)) < int(m.group(2)):
+            parts[int(m.group(1))] = (int(m.group(2)), path)
+    paths = []
+    i = 0
+    while i < total:
+        if i not in parts:
+            raise ValueError(f'Missing part starting at frame {i} of {total} '
+                             f'for "{name}.{ext}".')
+        i, path = parts[i]
+        paths.append(path)
+    if i != total:
+        raise ValueError(f'Parts of "{name}.{ext}" end at frame {i} instead '
+                         f'of {total}.')
+    return paths
+
+def _gif_sections(data):
+    '''Splits a GIF into its header (including the global color table and
+    any application extensions) and its frame data (excluding the
+    trailer).'''
+    pos = 13
+    flags = data[10]
+    if flags & 0x80:
+        pos += 3 * 2**((flags & 7) + 1)
+    while data[pos:pos+2] == b'!\xff':
+        pos += 2
+        while data[pos]:
+            pos += data[pos] + 1
+        pos += 1
+    if data[-1:] != b';':
+        raise ValueError('Truncated GIF.')
+    return data[:pos], data[pos:-1]
+
+def merge_gifs(paths, out_path):
+    '''Concatenates GIFs that share a global palette without re-encoding.'''
+    header = None
+    with open(out_path, 'wb') as out:
+        for path in paths:
+            with open(path, 'rb') as f:
+                part_header, body = _gif_sections(f.read())
+            if header is None:
+                header = part_header
+                out.write(header)
+            elif part_header[6:13+768] != header[6:13+768]:
+                raise ValueError(f'GIF part "{path}" has a different size or '
+                                 f'palette.')
+            out.write(body)
+        out.write(b';')
+
+def merge_videos(paths, out_path):
+    '''Concatenates videos with the same encoding using ffmpeg without
+    re-encoding.'''
+    import imageio_ffmpeg  # pip install imageio-ffmpeg
+    with tempfile.NamedTemporaryFile('w', suffix='.txt', delete=False) as f:
+        for path in paths:
+            escaped = os.path.abspath(path).replace("'", r"'\''")
+            f.write(f"file '{escaped}'\n")
+        list_path = f.name
+    try:
+        subprocess.run([imageio_ffmpeg.get_ffmpeg_exe(), '-y', '-v', 'error',
+                        '-f', 'concat', '-safe', '0', '-i', list_path,
+                        '-c', 'copy', out_path], check=True)
+    finally:
+        os.remove(list_path)
+
+def merge_parts(name, ext, total):
+    '''Merges the parts of `{name}.{ext}` after checking they cover every
+    frame.'''
+    paths = find_parts(name, ext, total)
+    if ext == 'gif':
+        merge_gifs(paths, f'{name}.{ext}')
+    else:
+        merge_videos(paths, f'{name}.{ext}')
+    return paths
@@ -77,6 +77,7 @@ render_animation('hzh_x_compare',
                  r'& \gate{H} & \gate{Z} & \gate{H} & \qw & \push{=} & & \gate{X} & \qw',
                  r'$HZH\ket{\psi}=X\ket{\psi}$',
                  save='gif',  # False, 'gif', or 'mp4'
+                 optimize_gif=True,
                  preview=False,
                  fps=fps,
                  w=w)
@@ -84,42 +85,49 @@ render_animation('hzh_x_compare',
 print('Rendering ry_gate_arrows')
 #$ animate_bloch ry_gate_arrows --style arrows ry,0.666667 ry,0.666667 ry,0.666667
 do_or_save_animation('ry_gate_arrows', save='gif', fps=fps, preview=False,
-                     style='arrows'
+                     style='arrows', optimize_gif=True
         )(gate_sequence('ry;0.666667,ry;0.666667,ry;0.666667'))
 
 print('Rendering xyss_gate')
 #$ animate_bloch xyss_gate x y s s
-do_or_save_animation('xyss_gate', save='gif', fps=fps, preview=False
+do_or_save_animation('xyss_gate', save='gif', fps=fps, preview=False,
+                     optimize_gif=True
         )(gate_sequence('x,y,s,s'))
 
 print('Rendering xx_gate')
 #$ #animate_bloch xx_gate x x
-do_or_save_animation('xx_gate', save='gif', fps=fps, preview=False
+do_or_save_animation('xx_gate', save='gif', fps=fps, preview=False,
+                     optimize_gif=True
         )(gate_sequence('x,x'))
 
 print('Rendering yy_gate')
 #$ #animate_bloch yy_gate y y
-do_or_save_animation('yy_gate', save='gif', fps=fps, preview=False
+do_or_save_animation('yy_gate', save='gif', fps=fps, preview=False,
+                     optimize_gif=True
         )(gate_sequence('y,y'))
 
 print('Rendering zz_gate')
 #$ animate_bloch zz_gate z z
-do_or_save_animation('zz_gate', save='gif', fps=fps, preview=False
+do_or_save_animation('zz_gate', save='gif', fps=fps, preview=False,
+                     optimize_gif=True
         )(gate_sequence('z,z'))
 
 print('Rendering hh_gate')
 #$ animate_bloch hh_gate h h
-do_or_save_animation('hh_gate', save='gif', fps=fps, preview=False
+do_or_save_animation('hh_gate', save='gif', fps=fps, preview=False,
+                     optimize_gif=True
         )(gate_sequence('h,h'))
 
 print('Rendering sqrt_xxxx_gate')
 #$ animate_bloch sqrt_xxxx_gate sqrt_x sqrt_x sqrt_x sqrt_x
-do_or_save_animation('sqrt_xxxx_gate', save='gif', fps=fps, preview=False
+do_or_save_animation('sqrt_xxxx_gate', save='gif', fps=fps, preview=False,
+                     optimize_gif=True
         )(gate_sequence('sqrt_x,sqrt_x,sqrt_x,sqrt_x'))
 
 print('Rendering ststs_gate')
 #$ animate_bloch ststs_gate s t s t s
-do_or_save_animation('ststs_gate', save='gif', fps=fps, preview=False
+do_or_save_animation('ststs_gate', save='gif', fps=fps, preview=False,
+                     optimize_gif=True
         )(gate_sequence('s,t,s,t,s'))
 
 print('Rendering xz_y_compare')
@@ -130,9 +138,7 @@ render_animation('xz_y_compare',
                  r'& \gate{X} & \gate{Z} & \qw & \push{=} & & \gate{Y} & \qw',
                  r'$ZX\ket{\psi}=Y\ket{\psi}$',
                  save='gif',  # False, 'gif', or 'mp4'
+                 optimize_gif=True,
                  preview=False,
                  fps=fps,
                  w=w)
-
-print()
-print('Please compress the rendered GIFs with https://gifcompressor.com/')
@@ -1,57 +1,64 @@
 #!/usr/bin/env python3
 
-try:
-    import numpy as np
-    import scipy as sp
-    from scipy.stats import unitary_group
-    import cirq
-except ImportError:
-    print('Install extra dependencies:')
-    print('    python3 -m pip install scipy "cirq~=0.10.0"')
-    print()
-    raise
+import numpy as np
+
+from bloch_sphere.animate_bloch import Rotations
 from bloch_sphere.animate_bloch_compare import main
 
-# Random unitary gate
-seed = 18
-u = unitary_group.rvs(2, random_state=seed)
+# Random unitary gate (from scipy.stats.unitary_group.rvs(2, random_state=18))
+u = np.array([
+    [0.0713757069495149+0.39781556844814614j,
+     0.8911081528434283+0.20633599272475217j],
+    [-0.12121630318723303+0.9066172785687223j,
+     -0.34707664441929825-0.20709785354007093j],
+])
 
 # Compute Bloch rotation axis and angle
-axis_angle = cirq.linalg.axis_angle(u)
-print('Axis angle:', axis_angle)
-#      Axis angle: 0.366*π around -0.233*X+0.831*Y-0.505*Z
+random_gate = Rotations.from_unitaries([u], labels=['Random'])
+print(f'Axis angle: {random_gate.angles[0]/np.pi:.3f}π around '
+      f'{random_gate.axes[0].round(3)}')
+#      Axis angle: 0.893π around [0.686 0.624 0.373]
+
+def rz(theta):
+    return np.diag([np.exp(-0.5j*theta), np.exp(0.5j*theta)])
+def rx(theta):
+    return np.array([[np.cos(theta/2), -1j*np.sin(theta/2)],
+                     [-1j*np.sin(theta/2), np.cos(theta/2)]])
+def equal_up_to_global_phase(u1, u2):
+    return np.isclose(abs(np.trace(u1.conj().T @ u2)), 2)
 
-# Decompose into Rz, Ry, Rz
-angles = np.array(
-    cirq.linalg.deconstruct_single_qubit_matrix_into_angles(u))
+# Decompose into Rz, Ry, Rz (applied in this order)
+v = u / np.sqrt(np.linalg.det(u))
+theta = 2*np.arctan2(abs(v[1, 0]), abs(v[0, 0]))
+phi_plus_lam = -2*np.angle(v[0, 0])
+phi_minus_lam = 2*np.angle(v[1, 0])
+angles = np.array([(phi_plus_lam - phi_minus_lam)/2, theta,
+                   (phi_plus_lam + phi_minus_lam)/2])
+# Restrict angles to [-pi, +pi)
+angles = (angles + np.pi) % (2*np.pi) - np.pi
 # Convert to Rz, Rx, Rz
 angles[0] -= np.pi/2
 angles[2] += np.pi/2
 print('Rz, Rx, Rz angles (radians):', angles)
-#      Rz, Rx, Rz angles (radians): [4.12326921 0.97622252 1.52745046]
-
-# Show the circuit
-q = cirq.LineQubit(0)
-circuit = cirq.Circuit(
-    cirq.rz(angles[0])(q),
-    cirq.rx(angles[1])(q),
-    cirq.rz(angles[2])(q),
-)
-print(circuit)
-#     0: ───Rz(1.31π)───Rx(0.311π)───Rz(0.486π)───
+#      Rz, Rx, Rz angles (radians): [0.40507011 2.30945471 1.88124001]
 
 # Check circuit
-assert cirq.equal_up_to_global_phase(u, cirq.unitary(circuit))
+assert equal_up_to_global_phase(
+    u, rz(angles[2]) @ rx(angles[1]) @ rz(angles[0]))
+
+def rotation_labels(names, angles):
+    return [f'{name}({a/np.pi:.3f}π)' if name != 'Rx(π/2)' else name
+            for name, a in zip(names, angles)]
+print(rotation_labels(['Rz', 'Rx', 'Rz'], angles))
+#     ['Rz(0.129π)', 'Rx(0.735π)', 'Rz(0.599π)']
 
 # Generate animation
 main('random_as_zxz',
      # Left gate
-     [f'custom;{axis_angle.axis[0]};{axis_angle.axis[1]};'
-      f'{axis_angle.axis[2]};{axis_angle.angle/np.pi};Random'],
+     random_gate,
      # Right gates
-     [f'custom;0;0;1;{angles[0]/np.pi};Rz({angles[0]/np.pi:.3f}π)',
-      f'custom;1;0;0;{angles[1]/np.pi};Rx({angles[1]/np.pi:.3f}π)',
-      f'custom;0;0;1;{angles[2]/np.pi};Rz({angles[2]/np.pi:.3f}π)'],
+     Rotations(axes=[(0, 0, 1), (1, 0, 0), (0, 0, 1)], angles=angles,
+               labels=rotation_labels(['Rz', 'Rx', 'Rz'], angles)),
      # Circuit diagram
      r'& \gate{U} & \qw & \push{=} & & \gate{R_Z} & \gate{R_X} & \gate{R_Z} & '
      r'\qw',
@@ -77,32 +84,25 @@ z_angles[1] = np.pi - z_angles[1]
 # Restrict angles to [-pi, +pi)
 z_angles = (z_angles + np.pi) % (2*np.pi) - np.pi
 
-# Show the circuit
-q = cirq.LineQubit(0)
-z_circuit = cirq.Circuit(
-    cirq.rz(z_angles[0])(q),
-    cirq.rx(np.pi/2)(q),
-    cirq.rz(z_angles[1])(q),
-    cirq.rx(np.pi/2)(q),
-    cirq.rz(z_angles[2])(q),
-)
-print(z_circuit)
-#     0: ───Rz(-0.371π)───Rx(0.5π)───Rz(0.265π)───Rx(0.5π)───Rz(0.099π)───
+print(rotation_labels(['Rz', 'Rx(π/2)', 'Rz', 'Rx(π/2)', 'Rz'],
+                      [z_angles[0], 0, z_angles[1], 0, z_angles[2]]))
+#     ['Rz(-0.371π)', 'Rx(π/2)', 'Rz(0.265π)', 'Rx(π/2)', 'Rz(0.099π)']
 
 # Check circuit
-assert cirq.equal_up_to_global_phase(u, cirq.unitary(z_circuit))
+assert equal_up_to_global_phase(
+    u, rz(z_angles[2]) @ rx(np.pi/2) @ rz(z_angles[1]) @ rx(np.pi/2)
+       @ rz(z_angles[0]))
 
 # Generate animation
+zxzxz_angles = [z_angles[0], np.pi/2, z_angles[1], np.pi/2, z_angles[2]]
 main('random_as_zxzxz',
      # Left gate
-     [f'custom;{axis_angle.axis[0]};{axis_angle.axis[1]};'
-      f'{axis_angle.axis[2]};{axis_angle.angle/np.pi};Random'],
+     random_gate,
      # Right gates
-     [f'custom;0;0;1;{z_angles[0]/np.pi};Rz({z_angles[0]/np.pi:.3f}π)',
-      f'custom;1;0;0;0.5;Rx(π/2)',
-      f'custom;0;0;1;{z_angles[1]/np.pi};Rz({z_angles[1]/np.pi:.3f}π)',
-      f'custom;1;0;0;0.5;Rx(π/2)',
-      f'custom;0;0;1;{z_angles[2]/np.pi};Rz({z_angles[2]/np.pi:.3f}π)'],
+     Rotations(axes=[(0, 0, 1), (1, 0, 0), (0, 0, 1), (1, 0, 0), (0, 0, 1)],
+               angles=zxzxz_angles,
+               labels=rotation_labels(['Rz', 'Rx(π/2)', 'Rz', 'Rx(π/2)', 'Rz'],
+                                      zxzxz_angles)),
      # Circuit diagram
      r'& \gate{U} & \qw & \push{=} & & \gate{R_Z} & \gate{\sqrt{X}} & \gate{R_Z} & \gate{\sqrt{X}} & \gate{R_Z} & '
      r'\qw',
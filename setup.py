@@ -42,6 +42,8 @@ setup(
         'drawSvg~=2.0',
         'hyperbolic~=2.0',
         'latextools~=0.5.0',
+        'Pillow',  # GIF encoding
+        'imageio-ffmpeg',  # Merging mp4 parts
     ],
 )
 